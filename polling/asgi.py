@@ -9,14 +9,20 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-from polls.routing import websocket_urlpatterns
+from django.urls import re_path
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'polling.settings')
+# Set up Django before importing consumers, which import models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.auth import AuthMiddlewareStack
+from polls.routing import http_urlpatterns, websocket_urlpatterns
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": URLRouter(
+        http_urlpatterns + [re_path(r'', django_asgi_app)]
+    ),
     "websocket": AuthMiddlewareStack(
         URLRouter(
             websocket_urlpatterns
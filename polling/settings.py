@@ -237,13 +237,86 @@ LOGOUT_REDIRECT_URL = 'home'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
-# Add Channels configuration with in-memory layer for development
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
-    }
+# Cache backend, e.g. CACHE_URL=redis://127.0.0.1:6379/1 (local memory by default)
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# Home page counters (see polls.stats)
+SITE_STATS_CACHE = 'default'
+SITE_STATS_TTL = int(os.getenv('SITE_STATS_TTL', 300))
+
+
+# Channels configuration. The in-memory layer only reaches sockets held by
+# the same process, so deployments running several workers must point
+# CHANNEL_LAYER_URL at a shared Redis, e.g. redis://127.0.0.1:6379/0.
+# CHANNEL_LAYER_BACKEND picks 'redis' (channels_redis core layer) or
+# 'redis-pubsub' (pub/sub layer, lighter for pure broadcast traffic).
+CHANNEL_LAYER_URL = os.getenv('CHANNEL_LAYER_URL')
+CHANNEL_LAYER_BACKENDS = {
+    'redis': 'channels_redis.core.RedisChannelLayer',
+    'redis-pubsub': 'channels_redis.pubsub.RedisPubSubChannelLayer',
 }
 
+if CHANNEL_LAYER_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': CHANNEL_LAYER_BACKENDS[os.getenv('CHANNEL_LAYER_BACKEND', 'redis')],
+            'CONFIG': {
+                'hosts': [CHANNEL_LAYER_URL],
+                'prefix': 'polling',
+            },
+        }
+    }
+else:
+    # In-memory layer for development
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        }
+    }
+
+# Newest state per poll for the delta WebSocket protocol (see polls.protocol).
+# Every worker serves and advances it, so once CHANNEL_LAYER_URL spreads
+# sockets over several workers it is kept in Redis: POLL_STATE_CACHE_URL,
+# or else the channel layer's server.
+POLL_STATE_CACHE = 'default'
+POLL_STATE_TIMEOUT = 3600
+if CHANNEL_LAYER_URL:
+    CACHES['poll_state'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('POLL_STATE_CACHE_URL', CHANNEL_LAYER_URL),
+    }
+    POLL_STATE_CACHE = 'poll_state'
+
+# Cache holding poll version stamps for conditional GETs and /polls/<id>/version/
+POLL_VERSION_CACHE = 'default'
+POLL_VERSION_TIMEOUT = 60
+
+# Seconds over which poll_update broadcasts are coalesced per poll (0 sends every update)
+POLL_BROADCAST_WINDOW = float(os.getenv('POLL_BROADCAST_WINDOW', 0.15))
+
+# Seconds between keep-alive comments on the server-sent events fallback stream
+POLL_STREAM_HEARTBEAT = 15
+
+# Frames a WebSocket may have waiting before its intermediate updates are
+# dropped for one snapshot, and the sockets one worker accepts per poll (0 for
+# no limit); see polls/sockets.py
+POLL_SOCKET_QUEUE_LIMIT = 8
+POLL_MAX_SUBSCRIBERS = int(os.getenv('POLL_MAX_SUBSCRIBERS', 5000))
+
+# Bulk vote import (POST /polls/api/votes/bulk/)
+BULK_VOTE_MAX_ITEMS = 10000
+BULK_VOTE_CHUNK_SIZE = 500
+
+# 'direct' inserts each web vote immediately; 'buffered' queues it in memory
+# and writes batches every VOTE_BUFFER_FLUSH_INTERVAL seconds (see polls/buffer.py
+# for what a crash can lose)
+VOTE_INGEST_MODE = os.getenv('VOTE_INGEST_MODE', 'direct')
+VOTE_BUFFER_FLUSH_INTERVAL = float(os.getenv('VOTE_BUFFER_FLUSH_INTERVAL', 0.2))
+VOTE_BUFFER_BATCH_SIZE = 500
+VOTE_BUFFER_MAX_SIZE = 10000
+
 # Add REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
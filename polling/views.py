@@ -1,11 +1,12 @@
 from django.shortcuts import render
-from polls.models import Poll, Vote
+from polls.stats import get_site_stats
 
 def home(request):
-    # Get total counts
-    total_polls = Poll.objects.count()
-    total_votes = Vote.objects.count()
-    total_completed_polls = Poll.objects.filter(active=False).count()
+    # Get total counts (cached, see polls.stats)
+    stats = get_site_stats()
+    total_polls = stats['total_polls']
+    total_votes = stats['total_votes']
+    total_completed_polls = stats['total_completed_polls']
     
     # Calculate percentages for circular progress bars
     max_polls = max(total_polls, 1)  # Avoid division by zero
@@ -0,0 +1,136 @@
+"""
+Coalesced ``poll_update`` broadcasts.
+
+Votes only mark their poll as dirty. A background thread wakes up once per
+``POLL_BROADCAST_WINDOW`` seconds, tallies each dirty poll once and sends
+the latest state to its group, so a poll receiving hundreds of votes per
+second still pushes at most one snapshot per window. A window of ``0``
+sends synchronously on every notification.
+
+Consumers register the event loop they run on (``bind_loop``) and sends
+from the background thread are scheduled on it. The in-memory channel layer
+only wakes receivers waiting on the loop the message was sent from.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+
+from .protocol import build_update_message
+from .tally import versioned_tally, poll_update_data
+
+logger = logging.getLogger(__name__)
+
+
+def poll_group_name(poll_id):
+    return f'poll_{poll_id}'
+
+
+class PollBroadcaster:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = Counter()
+        self._loop = None
+
+    def bind_loop(self, loop=None):
+        """
+        Send from now on through ``loop`` (by default the running one), the
+        event loop holding this process's sockets
+        """
+        self._loop = loop or asyncio.get_running_loop()
+
+    def group_send(self, group, message):
+        loop = self._loop
+        try:
+            current = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        # Blocking on the loop from its own thread would deadlock
+        if loop is None or loop is current or not loop.is_running():
+            async_to_sync(get_channel_layer().group_send)(group, message)
+            return
+        asyncio.run_coroutine_threadsafe(
+            get_channel_layer().group_send(group, message), loop).result(timeout=10)
+
+    @property
+    def window(self):
+        return getattr(settings, 'POLL_BROADCAST_WINDOW', 0.15)
+
+    def notify(self, poll_id):
+        """
+        Schedule a ``poll_update`` for ``poll_id``
+        """
+        if self.window <= 0:
+            with self._lock:
+                self._stats['requested'] += 1
+            self.send(poll_id)
+            return
+
+        with self._lock:
+            self._stats['requested'] += 1
+            if poll_id in self._dirty:
+                self._stats['merged'] += 1
+                return
+            self._dirty.add(poll_id)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='poll-broadcaster', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def send(self, poll_id):
+        """
+        Tally ``poll_id`` and send its current state to the poll's group
+        """
+        try:
+            versioned = versioned_tally(poll_id)
+            if versioned is None:
+                # Deleted since it was scheduled
+                return
+            version, tally = versioned
+            message = build_update_message(poll_id, version, poll_update_data(tally))
+            self.group_send(poll_group_name(poll_id), message)
+        except Exception:
+            logger.exception('Failed to broadcast poll %s', poll_id)
+            outcome = 'failed'
+        else:
+            outcome = 'sent'
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        for poll_id in dirty:
+            self.send(poll_id)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            time.sleep(self.window)
+            self.flush()
+            close_old_connections()
+
+    def metrics(self):
+        """
+        Counts of requested, merged, sent and failed broadcasts, plus the
+        number of polls currently waiting for the next window
+        """
+        with self._lock:
+            metrics = {name: self._stats[name]
+                       for name in ('requested', 'merged', 'sent', 'failed')}
+            metrics['pending'] = len(self._dirty)
+        return metrics
+
+
+broadcaster = PollBroadcaster()
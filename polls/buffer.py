@@ -0,0 +1,126 @@
+"""
+Write-behind vote buffer used when ``VOTE_INGEST_MODE = 'buffered'``.
+
+``poll_vote`` validates the choice and appends the vote to an in-process
+buffer instead of inserting it. A background thread drains the buffer every
+``VOTE_BUFFER_FLUSH_INTERVAL`` seconds, or as soon as
+``VOTE_BUFFER_BATCH_SIZE`` votes are waiting, through
+``polls.ingest.ingest_votes`` so each flush is a few chunked ``bulk_create``
+calls plus one counter reconciliation per poll.
+
+Durability: buffered votes live only in the worker's memory. They survive
+failed flushes (the batch is put back and retried) and are flushed on a
+clean interpreter exit, but a crash or ``SIGKILL`` loses whatever has not
+been flushed yet, i.e. at most one interval's worth of votes. Use the
+default ``'direct'`` mode where every acknowledged vote must be persisted.
+
+Backpressure: once ``VOTE_BUFFER_MAX_SIZE`` votes are waiting, ``submit``
+raises ``VoteBufferFull`` and the view asks the voter to retry.
+"""
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .ingest import ingest_votes
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBufferFull(Exception):
+    pass
+
+
+def buffering_enabled():
+    return getattr(settings, 'VOTE_INGEST_MODE', 'direct') == 'buffered'
+
+
+class VoteBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = []
+        self._pending = set()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stats = Counter()
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'VOTE_BUFFER_MAX_SIZE', 10000)
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'VOTE_BUFFER_BATCH_SIZE', 500)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'VOTE_BUFFER_FLUSH_INTERVAL', 0.2)
+
+    def submit(self, user_id, poll_id, choice_id):
+        """
+        Queue a validated vote. Returns False if the same user already has a
+        vote for this poll waiting in the buffer.
+        """
+        with self._lock:
+            if (user_id, poll_id) in self._pending:
+                self._stats['duplicate'] += 1
+                return False
+            if len(self._items) >= self.max_size:
+                self._stats['rejected'] += 1
+                raise VoteBufferFull()
+            self._items.append({'user': user_id, 'poll': poll_id, 'choice': choice_id})
+            self._pending.add((user_id, poll_id))
+            self._stats['queued'] += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='vote-buffer', daemon=True)
+                self._thread.start()
+            if len(self._items) >= self.batch_size:
+                self._wakeup.set()
+        return True
+
+    def flush(self):
+        """
+        Write every buffered vote to the database
+        """
+        with self._lock:
+            items, self._items = self._items, []
+        if not items:
+            return
+        try:
+            results = ingest_votes(items)
+        except Exception:
+            logger.exception('Failed to flush %d buffered votes', len(items))
+            with self._lock:
+                # Put the batch back in front of anything queued meanwhile
+                self._items[:0] = items
+                self._stats['failed_flushes'] += 1
+            return
+        with self._lock:
+            for item in items:
+                self._pending.discard((item['user'], item['poll']))
+            self._stats['flushes'] += 1
+            self._stats['flushed'] += sum(result['status'] == 'created' for result in results)
+            self._stats['discarded'] += sum(result['status'] != 'created' for result in results)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+    def metrics(self):
+        with self._lock:
+            metrics = {name: self._stats[name] for name in (
+                'queued', 'duplicate', 'rejected', 'flushes', 'flushed',
+                'discarded', 'failed_flushes')}
+            metrics['waiting'] = len(self._items)
+        return metrics
+
+
+vote_buffer = VoteBuffer()
+atexit.register(vote_buffer.flush)
@@ -0,0 +1,108 @@
+"""
+ETag / Last-Modified support for poll reads.
+
+Every vote, edit or end bumps ``Poll.version`` (see ``PollQuerySet.bump_version``),
+so the version alone tells whether a poll page or API response changed.
+The functions here plug into ``django.views.decorators.http.condition`` and
+read the cached stamp from ``polls.versions``, so a 304 usually costs no
+query at all and never reads the vote table. Both sync and async views can
+be decorated.
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib import messages
+from django.views.decorators.http import condition
+
+from . import versions
+
+
+def _poll_id(kwargs):
+    return kwargs.get('poll_id', kwargs.get('pk'))
+
+
+def get_poll_version(request, poll_id):
+    """
+    Return the poll's ``(version, modified_at)``, or ``None`` if it does not
+    exist. The lookup is done once per request.
+    """
+    stamps = request.__dict__.setdefault('_poll_versions', {})
+    if poll_id not in stamps:
+        stamps[poll_id] = versions.get_poll_version(poll_id)
+    return stamps[poll_id]
+
+
+async def aget_poll_version(request, poll_id):
+    """
+    Async ``get_poll_version()``, sharing the same per-request memo
+    """
+    stamps = request.__dict__.setdefault('_poll_versions', {})
+    if poll_id not in stamps:
+        stamps[poll_id] = await versions.aget_poll_version(poll_id)
+    return stamps[poll_id]
+
+
+def poll_etag(request, *args, **kwargs):
+    version = get_poll_version(request, _poll_id(kwargs))
+    if version is None:
+        return None
+    return f'{_poll_id(kwargs)}-{version[0]}'
+
+
+def _has_pending_messages(request):
+    # Flash messages have to be rendered, not revalidated
+    return hasattr(request, '_messages') and len(messages.get_messages(request)) > 0
+
+
+def poll_page_etag(request, *args, **kwargs):
+    """
+    ETag for HTML pages, which also differ per visitor (voting form, navbar,
+    CSRF token), so the session is folded into the tag
+    """
+    etag = poll_etag(request, *args, **kwargs)
+    if etag is None or _has_pending_messages(request):
+        return None
+    session_key = getattr(getattr(request, 'session', None), 'session_key', None) or ''
+    return f'{etag}-{hashlib.md5(session_key.encode()).hexdigest()[:12]}'
+
+
+def poll_last_modified(request, *args, **kwargs):
+    version = get_poll_version(request, _poll_id(kwargs))
+    return version[1] if version else None
+
+
+def poll_page_last_modified(request, *args, **kwargs):
+    if _has_pending_messages(request):
+        return None
+    return poll_last_modified(request, *args, **kwargs)
+
+
+def _poll_condition(etag_func, last_modified_func):
+    """
+    ``condition()`` that also accepts async views. Django calls the
+    condition functions synchronously, so for async views the stamp (and the
+    session flash messages may be stored in) is loaded asynchronously first
+    and the functions only read the per-request memo.
+    """
+    decorator = condition(etag_func=etag_func, last_modified_func=last_modified_func)
+
+    def wrap(view):
+        conditional_view = decorator(view)
+        if not iscoroutinefunction(view):
+            return conditional_view
+
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            await aget_poll_version(request, _poll_id(kwargs))
+            session = getattr(request, 'session', None)
+            if session is not None:
+                await session.akeys()
+            return await conditional_view(request, *args, **kwargs)
+        return inner
+
+    return wrap
+
+
+poll_api_condition = _poll_condition(poll_etag, poll_last_modified)
+poll_page_condition = _poll_condition(poll_page_etag, poll_page_last_modified)
@@ -1,13 +1,53 @@
 import json
+from collections import deque
+from urllib.parse import parse_qs
+from channels.generic.http import AsyncHttpConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from .models import Poll, Choice
+from channels.exceptions import StopConsumer
+from django.conf import settings
+from .broadcast import broadcaster, poll_group_name
+from .sockets import socket_registry
+from .protocol import (
+    LEGACY_VERSION, DELTA_VERSION, current_state, snapshot_frame, update_frame, msgpack,
+)
 import asyncio
 
+# Shared current_state() lookups per (event loop, poll id), see load_state()
+_inflight = {}
+
+
+async def load_state(poll_id):
+    """
+    Return ``current_state(poll_id)``, letting concurrent connects for the
+    same poll wait on a single cache read or tally (single-flight) instead
+    of each repeating it
+    """
+    key = (asyncio.get_running_loop(), str(poll_id))
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(current_state(poll_id))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # A client leaving must not cancel the lookup the others are waiting on
+    return await asyncio.shield(task)
+
+
 class PollConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.poll_id = self.scope['url_route']['kwargs']['poll_id']
         self.poll_group_name = f'poll_{self.poll_id}'
+        self.protocol = self.get_protocol_version()
+        self.use_msgpack = self.protocol == DELTA_VERSION and self.wants_msgpack()
+        self.frame_name = self.get_frame_name()
+
+        # Over POLL_MAX_SUBSCRIBERS: reject the handshake (see polls.sockets)
+        self.registered = socket_registry.join(self.poll_id)
+        if not self.registered:
+            await self.close()
+            return
+        self.init_outbox()
+        self.sender = asyncio.ensure_future(self.run_outbox())
+        broadcaster.bind_loop()
 
         # Join poll group
         await self.channel_layer.group_add(
@@ -18,34 +58,110 @@ class PollConsumer(AsyncWebsocketConsumer):
         try:
             await self.accept()
             # Send initial poll data
-            initial_data = await self.get_poll_data()
-            if initial_data:
-                await self.send(text_data=json.dumps(initial_data))
+            if self.protocol == DELTA_VERSION:
+                await self.send_snapshot()
+            else:
+                initial_data = await self.get_poll_data()
+                if initial_data:
+                    self.push(json.dumps(initial_data))
         except Exception as e:
             print(f"Error in connect: {e}")
             await self.close()
 
-    @database_sync_to_async
-    def get_poll_data(self):
+    def get_query(self):
+        return parse_qs(self.scope.get('query_string', b'').decode())
+
+    def get_protocol_version(self):
         try:
-            poll = Poll.objects.get(id=self.poll_id)
-            choices_data = []
-            total_votes = poll.get_vote_count
-            for choice in poll.choice_set.all():
-                choice_votes = choice.get_vote_count
-                choices_data.append({
-                    'id': choice.id,
-                    'votes': choice_votes,
-                    'percentage': round((choice_votes / total_votes * 100), 1) if total_votes > 0 else 0
-                })
-            return {'choices': choices_data}
-        except Poll.DoesNotExist:
-            return None
+            version = int(self.get_query().get('protocol', [LEGACY_VERSION])[0])
+        except ValueError:
+            return LEGACY_VERSION
+        return DELTA_VERSION if version >= DELTA_VERSION else LEGACY_VERSION
+
+    def wants_msgpack(self):
+        return msgpack is not None and self.get_query().get('encoding') == ['msgpack']
+
+    def get_frame_name(self):
+        # Keys of the pre-encoded frames in poll_update events (see protocol.encode_frames)
+        if self.protocol == LEGACY_VERSION:
+            return 'v1'
+        return 'v2-msgpack' if self.use_msgpack else 'v2'
+
+    def encode_frame(self, frame):
+        return msgpack.packb(frame) if self.use_msgpack else json.dumps(frame)
+
+    async def send_encoded(self, encoded):
+        if isinstance(encoded, bytes):
+            await self.send(bytes_data=encoded)
+        else:
+            await self.send(text_data=encoded)
+
+    def init_outbox(self):
+        self.outbox = deque()
+        self.outbox_ready = asyncio.Event()
+        self.outbox_limit = getattr(settings, 'POLL_SOCKET_QUEUE_LIMIT', 8)
+
+    def push(self, encoded, replace=False):
+        """
+        Queue an encoded frame for this socket. ``replace`` drops the frames
+        still waiting, for a frame that carries the full current state.
+        """
+        if replace and self.outbox:
+            socket_registry.record(self.poll_id, 'dropped', len(self.outbox))
+            self.outbox.clear()
+        self.outbox.append(encoded)
+        socket_registry.record(self.poll_id, 'queued')
+        self.outbox_ready.set()
+
+    async def drain_outbox(self):
+        while self.outbox:
+            encoded = self.outbox.popleft()
+            try:
+                await self.send_encoded(encoded)
+            except Exception as e:
+                print(f"Error sending poll frame: {e}")
+            else:
+                socket_registry.record(self.poll_id, 'sent')
+
+    async def run_outbox(self):
+        while True:
+            await self.outbox_ready.wait()
+            self.outbox_ready.clear()
+            await self.drain_outbox()
+
+    async def send_snapshot(self):
+        state = await load_state(self.poll_id)
+        if state is not None:
+            # Supersedes anything still queued
+            self.push(self.encode_frame(snapshot_frame(state['seq'], state['data'])), replace=True)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data or '{}')
+        except ValueError:
+            return
+        if not isinstance(message, dict):
+            return
+        if self.protocol == DELTA_VERSION and message.get('action') == 'resync':
+            try:
+                await self.send_snapshot()
+            except Exception as e:
+                print(f"Error in resync: {e}")
+
+    async def get_poll_data(self):
+        try:
+            state = await load_state(self.poll_id)
         except Exception as e:
             print(f"Error getting poll data: {e}")
             return None
+        return state['data'] if state is not None else None
 
     async def disconnect(self, close_code):
+        if not getattr(self, 'registered', False):
+            return
+        self.registered = False
+        socket_registry.leave(self.poll_id)
+        self.sender.cancel()
         try:
             await self.channel_layer.group_discard(
                 self.poll_group_name,
@@ -54,8 +170,95 @@ class PollConsumer(AsyncWebsocketConsumer):
         except Exception as e:
             print(f"Error in disconnect: {e}")
 
+    def update_frame(self, event):
+        encoded = event.get('frames', {}).get(self.frame_name)
+        if encoded is not None:
+            return encoded
+        if self.protocol == DELTA_VERSION:
+            return self.encode_frame(update_frame(event))
+        return json.dumps(event['data'])
+
+    def latest_frame(self, event):
+        """
+        Frame carrying the full state in ``event``, for a socket that has
+        to skip the updates before it
+        """
+        if self.protocol == DELTA_VERSION and event.get('delta') is not None:
+            return self.encode_frame(snapshot_frame(event['seq'], event['data']))
+        return self.update_frame(event)
+
     async def poll_update(self, event):
         try:
-            await self.send(text_data=json.dumps(event['data']))
+            if len(self.outbox) >= self.outbox_limit:
+                # The client is not keeping up: skip what it has not been
+                # sent yet and catch it up with the newest state
+                self.push(self.latest_frame(event), replace=True)
+            else:
+                self.push(self.update_frame(event))
         except Exception as e:
-            print(f"Error in poll_update: {e}") 
\ No newline at end of file
+            print(f"Error in poll_update: {e}")
+
+
+class PollStreamConsumer(AsyncHttpConsumer):
+    """
+    Server-sent events fallback for browsers that cannot keep a WebSocket
+    open. Streams the same ``{'choices': [...]}`` payloads as protocol 1 of
+    ``PollConsumer``, fed by the same channel layer group.
+    """
+
+    async def http_request(self, message):
+        # AsyncHttpConsumer ends the response once handle() returns; the
+        # stream stays open until the client goes away instead
+        if 'body' in message:
+            self.body.append(message['body'])
+        if not message.get('more_body'):
+            await self.start_stream()
+
+    async def start_stream(self):
+        self.poll_id = self.scope['url_route']['kwargs']['poll_id']
+        self.poll_group_name = poll_group_name(self.poll_id)
+        self.heartbeat = None
+
+        initial_data = await self.get_poll_data()
+        if initial_data is None:
+            await self.send_response(404, b'Poll not found',
+                                     headers=[(b'Content-Type', b'text/plain')])
+            raise StopConsumer()
+
+        await self.channel_layer.group_add(self.poll_group_name, self.channel_name)
+        broadcaster.bind_loop()
+        await self.send_headers(headers=[
+            (b'Content-Type', b'text/event-stream'),
+            (b'Cache-Control', b'no-cache'),
+            (b'X-Accel-Buffering', b'no'),
+        ])
+        await self.send_body(b'retry: 2000\n\n', more_body=True)
+        await self.send_event(json.dumps(initial_data))
+        self.heartbeat = asyncio.ensure_future(self.send_heartbeats())
+
+    async def send_event(self, data):
+        await self.send_body(f'data: {data}\n\n'.encode(), more_body=True)
+
+    async def send_heartbeats(self):
+        # Comment lines keep proxies from closing an idle stream
+        interval = getattr(settings, 'POLL_STREAM_HEARTBEAT', 15)
+        while True:
+            await asyncio.sleep(interval)
+            await self.send_body(b': keep-alive\n\n', more_body=True)
+
+    async def get_poll_data(self):
+        state = await load_state(self.poll_id)
+        return state['data'] if state is not None else None
+
+    async def poll_update(self, event):
+        try:
+            encoded = event.get('frames', {}).get('v1') or json.dumps(event['data'])
+            await self.send_event(encoded)
+        except Exception as e:
+            print(f"Error in stream poll_update: {e}")
+
+    async def disconnect(self):
+        if getattr(self, 'heartbeat', None) is not None:
+            self.heartbeat.cancel()
+        if hasattr(self, 'poll_group_name'):
+            await self.channel_layer.group_discard(self.poll_group_name, self.channel_name)
@@ -0,0 +1,156 @@
+"""
+Batch vote ingestion for imports from kiosks and offline events.
+
+``ingest_votes`` validates a whole batch against a handful of prefetch
+queries, inserts the accepted votes with chunked ``bulk_create`` calls and
+then adds them to the vote counters with a few relative UPDATEs.
+``bulk_create`` skips ``Vote.save()`` and the model signals, so the
+counters, home page stats and live broadcasts are all updated here
+instead.
+"""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+
+from .broadcast import broadcaster
+from .models import Poll, Choice, Vote, VoteRollup
+from .stats import adjust_site_stats
+from .versions import forget_poll_versions
+
+CREATED = 'created'
+DUPLICATE = 'duplicate'
+ALREADY_VOTED = 'already_voted'
+INVALID = 'invalid'
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _existing_votes(pairs):
+    """
+    Return the ``(user_id, poll_id)`` pairs among ``pairs`` that already
+    have a vote
+    """
+    users = {user_id for user_id, _ in pairs}
+    polls = {poll_id for _, poll_id in pairs}
+    existing = Vote.objects.filter(user_id__in=users, poll_id__in=polls).values_list('user_id', 'poll_id')
+    return set(existing) & set(pairs)
+
+
+def _vote_key(vote):
+    return vote.user_id, vote.poll_id, vote.choice_id, vote.created_at
+
+
+def _inserted_votes(votes):
+    """
+    Return the keys of ``votes`` that are now stored. A row written by
+    someone else for the same user and poll has its own choice or timestamp.
+    """
+    votes = list(votes)
+    if not votes:
+        return set()
+    stored = Vote.objects.filter(
+        user_id__in={vote.user_id for vote in votes},
+        poll_id__in={vote.poll_id for vote in votes},
+    ).values_list('user_id', 'poll_id', 'choice_id', 'created_at')
+    return set(stored) & {_vote_key(vote) for vote in votes}
+
+
+def _by_count(counts):
+    """
+    Group the keys of ``counts`` by their count, so rows gaining the same
+    number of votes share one UPDATE
+    """
+    groups = defaultdict(list)
+    for pk, count in counts.items():
+        groups[count].append(pk)
+    return groups.items()
+
+
+def ingest_votes(items, chunk_size=None):
+    """
+    Record a batch of votes given as dicts with ``user``, ``poll`` and
+    ``choice`` ids. Returns one ``{'status': ..., 'errors': [...]}`` result
+    per item, in order.
+    """
+    chunk_size = chunk_size or getattr(settings, 'BULK_VOTE_CHUNK_SIZE', 500)
+    results = [{'status': None, 'errors': []} for _ in items]
+
+    choices = dict(
+        Choice.objects.filter(pk__in={item['choice'] for item in items})
+        .values_list('pk', 'poll_id')
+    )
+    active_polls = set(
+        Poll.objects.filter(pk__in={item['poll'] for item in items}, active=True)
+        .values_list('pk', flat=True)
+    )
+    users = set(
+        User.objects.filter(pk__in={item['user'] for item in items}, is_active=True)
+        .values_list('pk', flat=True)
+    )
+
+    accepted = []
+    seen = set()
+    for index, item in enumerate(items):
+        errors = results[index]['errors']
+        if item['user'] not in users:
+            errors.append('Unknown user.')
+        if item['poll'] not in active_polls:
+            errors.append('Unknown or closed poll.')
+        if choices.get(item['choice']) != item['poll']:
+            errors.append('Choice does not belong to poll.')
+        if errors:
+            results[index]['status'] = INVALID
+            continue
+
+        key = (item['user'], item['poll'])
+        if key in seen:
+            results[index]['status'] = DUPLICATE
+            continue
+        seen.add(key)
+        accepted.append((index, item))
+
+    choice_counts = Counter()
+    poll_counts = Counter()
+    with transaction.atomic():
+        for chunk in _chunks(accepted, chunk_size):
+            existing = _existing_votes([(item['user'], item['poll']) for _, item in chunk])
+            new_votes = {}
+            for index, item in chunk:
+                if (item['user'], item['poll']) in existing:
+                    results[index]['status'] = ALREADY_VOTED
+                    continue
+                new_votes[index] = Vote(user_id=item['user'], poll_id=item['poll'],
+                                        choice_id=item['choice'])
+            # ignore_conflicts covers votes inserted concurrently since the
+            # check; those rows are skipped, so only ours are counted below
+            Vote.objects.bulk_create(new_votes.values(), ignore_conflicts=True)
+            inserted = _inserted_votes(new_votes.values())
+            for index, vote in new_votes.items():
+                if _vote_key(vote) in inserted:
+                    results[index]['status'] = CREATED
+                    choice_counts[vote.choice_id] += 1
+                    poll_counts[vote.poll_id] += 1
+                else:
+                    results[index]['status'] = ALREADY_VOTED
+            VoteRollup.record((vote.poll_id, vote.choice_id, vote.created_at)
+                              for vote in new_votes.values() if _vote_key(vote) in inserted)
+
+        # Relative updates like Vote.save(), so votes counted concurrently
+        # by other requests are kept
+        for count, pks in _by_count(choice_counts):
+            Choice.objects.filter(pk__in=pks).update(votes=F('votes') + count)
+        for count, pks in _by_count(poll_counts):
+            Poll.objects.filter(pk__in=pks).bump_version(total_votes=F('total_votes') + count)
+        forget_poll_versions(list(poll_counts))
+
+    created = sum(poll_counts.values())
+    transaction.on_commit(lambda: adjust_site_stats(total_votes=created))
+    for poll_id in poll_counts:
+        transaction.on_commit(lambda poll_id=poll_id: broadcaster.notify(poll_id))
+    return results
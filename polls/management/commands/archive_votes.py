@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from polls.models import ArchivedVote, PollResult, Vote
+from polls.signals import vote_counters_frozen
+
+
+class Command(BaseCommand):
+    help = (
+        'Move the votes of polls that ended more than --days ago from the vote '
+        'table to ArchivedVote. Their results keep being served from PollResult.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30,
+                            help='Only archive polls ended at least this many days ago')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **kwargs):
+        cutoff = timezone.now() - timedelta(days=kwargs['days'])
+        results = PollResult.objects.filter(
+            archived_at__lte=cutoff, votes_archived_at__isnull=True, poll__active=False)
+
+        num_polls = num_votes = 0
+        for result in results.iterator():
+            num_votes += self.archive(result, kwargs['batch_size'])
+            num_polls += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {num_votes} votes from {num_polls} ended polls'
+        ))
+
+    def archive(self, result, batch_size):
+        votes = Vote.objects.filter(poll_id=result.poll_id).order_by('pk')
+        num_votes = 0
+        # The poll's counters, rollups and the site stats keep the final
+        # numbers, so the per-vote counter updates are skipped
+        with transaction.atomic(), vote_counters_frozen():
+            while True:
+                batch = list(votes.values_list('pk', 'user_id', 'choice_id', 'created_at')[:batch_size])
+                if not batch:
+                    break
+                ArchivedVote.objects.bulk_create([
+                    ArchivedVote(user_id=user_id, poll_id=result.poll_id,
+                                 choice_id=choice_id, created_at=created_at)
+                    for _, user_id, choice_id, created_at in batch
+                ])
+                Vote.objects.filter(pk__in=[row[0] for row in batch]).delete()
+                num_votes += len(batch)
+            result.votes_archived_at = timezone.now()
+            result.save(update_fields=['votes_archived_at'])
+        return num_votes
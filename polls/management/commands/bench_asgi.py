@@ -0,0 +1,125 @@
+import asyncio
+import subprocess
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.models import Poll
+
+
+async def _read_response(reader):
+    """
+    Read one HTTP/1.1 response and return its status code
+    """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Server closed the connection')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    return int(status_line.split()[1])
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure requests/sec and p50/p99 latency of the poll read views served '
+        'by gunicorn with uvicorn workers, as started by render.yaml. Run it on '
+        'two revisions to compare them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=int, help='Poll to read (default: the first one)')
+        parser.add_argument('--paths', nargs='+',
+                            help='Paths to load (default: detail, results and version of --poll)')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=2000,
+                            help='Requests per path, after a short warm-up')
+
+    def handle(self, *args, **kwargs):
+        paths = kwargs['paths']
+        if not paths:
+            poll_id = kwargs['poll'] or Poll.objects.order_by('pk').values_list('pk', flat=True).first()
+            if poll_id is None:
+                raise CommandError('No polls to read; create one first (see seeder.py)')
+            paths = [f'/polls/{poll_id}/', f'/polls/{poll_id}/results/',
+                     f'/polls/{poll_id}/version/']
+
+        server = subprocess.Popen([
+            sys.executable, '-m', 'gunicorn', 'polling.asgi:application',
+            '-w', str(kwargs['workers']), '-k', 'uvicorn.workers.UvicornWorker',
+            '-b', f"127.0.0.1:{kwargs['port']}", '--log-level', 'warning',
+        ])
+        try:
+            asyncio.run(self.wait_for_server(kwargs['port'], server))
+            self.stdout.write(f"{'path':<28}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+            for path in paths:
+                asyncio.run(self.load(path, kwargs['port'], kwargs['concurrency'], 100))
+                rate, latencies, errors = asyncio.run(
+                    self.load(path, kwargs['port'], kwargs['concurrency'], kwargs['requests']))
+                latencies.sort()
+                p50 = latencies[int(0.50 * (len(latencies) - 1))]
+                p99 = latencies[int(0.99 * (len(latencies) - 1))]
+                self.stdout.write(f'{path:<28}{rate:>10.0f}{p50 * 1000:>10.2f}'
+                                  f'{p99 * 1000:>10.2f}{errors:>8}')
+        finally:
+            server.terminate()
+            server.wait()
+
+    async def wait_for_server(self, port, server, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('gunicorn exited before accepting connections')
+            try:
+                _, writer = await asyncio.open_connection('127.0.0.1', port)
+            except OSError:
+                await asyncio.sleep(0.2)
+            else:
+                writer.close()
+                return
+        raise CommandError(f'gunicorn did not start listening on port {port}')
+
+    async def load(self, path, port, concurrency, total):
+        """
+        Issue ``total`` GETs for ``path`` over ``concurrency`` keep-alive
+        connections and return ``(requests/sec, latencies, errors)``
+        """
+        request = f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n\r\n'.encode()
+        latencies = []
+        errors = 0
+        remaining = total
+
+        async def client():
+            nonlocal remaining, errors
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            try:
+                while remaining > 0:
+                    remaining -= 1
+                    start = time.perf_counter()
+                    writer.write(request)
+                    status = await _read_response(reader)
+                    latencies.append(time.perf_counter() - start)
+                    if status >= 400:
+                        errors += 1
+            finally:
+                writer.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(min(concurrency, total))))
+        return len(latencies) / (time.perf_counter() - start), latencies, errors
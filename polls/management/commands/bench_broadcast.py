@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.consumers import PollConsumer
+from polls.protocol import DELTA_VERSION, LEGACY_VERSION, encode_frames
+
+
+async def _discard(message):
+    pass
+
+
+def _watchers(count, protocol):
+    consumers = []
+    for _ in range(count):
+        consumer = PollConsumer()
+        consumer.protocol = protocol
+        consumer.use_msgpack = False
+        consumer.frame_name = consumer.get_frame_name()
+        consumer.base_send = _discard
+        consumer.poll_id = None
+        consumer.init_outbox()
+        consumers.append(consumer)
+    return consumers
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure CPU time spent delivering one poll_update to N watchers, '
+        'encoding per socket versus forwarding pre-encoded frames'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--watchers', type=int, nargs='+', default=[10, 100, 1000, 10000])
+        parser.add_argument('--choices', type=int, default=10)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **kwargs):
+        choices = [{'id': pk, 'votes': pk * 37, 'percentage': 10.0}
+                   for pk in range(1, kwargs['choices'] + 1)]
+        event = {
+            'type': 'poll_update',
+            'data': {'choices': choices},
+            'seq': 2,
+            'base': 1,
+            'delta': [{'id': 1, 'votes': 38}],
+        }
+
+        self.stdout.write(f"{'protocol':<10}{'watchers':>10}{'per-socket ms':>16}"
+                          f"{'pre-encoded ms':>16}{'speedup':>10}")
+        for protocol in (LEGACY_VERSION, DELTA_VERSION):
+            for count in kwargs['watchers']:
+                consumers = _watchers(count, protocol)
+                per_socket = self.measure(consumers, event, kwargs['rounds'])
+                pre_encoded = self.measure(
+                    consumers, dict(event, frames=None), kwargs['rounds'], encode=True)
+                self.stdout.write(
+                    f"{'v%d' % protocol:<10}{count:>10}{per_socket * 1000:>16.2f}"
+                    f"{pre_encoded * 1000:>16.2f}{per_socket / pre_encoded:>9.1f}x"
+                )
+
+    def measure(self, consumers, event, rounds, encode=False):
+        """
+        Return the mean CPU seconds for one broadcast to ``consumers``
+        """
+        async def broadcast():
+            message = event
+            if encode:
+                # The sender encodes once, as build_update_message does
+                message = dict(event, frames=encode_frames(event))
+            for consumer in consumers:
+                await consumer.poll_update(message)
+                await consumer.drain_outbox()
+
+        total = 0.0
+        for _ in range(rounds):
+            start = time.process_time()
+            asyncio.run(broadcast())
+            total += time.process_time() - start
+        return total / rounds
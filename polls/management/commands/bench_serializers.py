@@ -0,0 +1,63 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.models import Poll, Vote
+from polls.serializers import (
+    PollSerializer, VoteSerializer, POLL_LIST_FIELDS, VOTE_LIST_FIELDS,
+    poll_list_data, vote_list_data,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure objects/sec serialized by the API list endpoints, comparing '
+        'the DRF serializers with the .values() fast paths on existing rows'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=1000)
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **kwargs):
+        limit, rounds = kwargs['limit'], kwargs['rounds']
+        polls = Poll.objects.order_by('-pub_date', '-id')
+        votes = Vote.objects.order_by('-created_at', '-id')
+        cases = [
+            (
+                'polls',
+                lambda: PollSerializer(polls.with_choices()[:limit], many=True).data,
+                lambda: poll_list_data(list(polls.values(*POLL_LIST_FIELDS)[:limit])),
+            ),
+            (
+                'votes',
+                lambda: VoteSerializer(votes[:limit], many=True).data,
+                lambda: vote_list_data(list(votes.values(*VOTE_LIST_FIELDS)[:limit])),
+            ),
+        ]
+
+        self.stdout.write(f"{'endpoint':<10}{'objects':>10}{'serializer/s':>16}"
+                          f"{'fast path/s':>16}{'speedup':>10}")
+        for name, slow, fast in cases:
+            count = len(fast())
+            if not count:
+                self.stdout.write(f'{name:<10}{"no rows to serialize":>30}')
+                continue
+            slow_rate = count / self.measure(slow, rounds)
+            fast_rate = count / self.measure(fast, rounds)
+            self.stdout.write(
+                f'{name:<10}{count:>10}{slow_rate:>16.0f}{fast_rate:>16.0f}'
+                f'{fast_rate / slow_rate:>9.1f}x'
+            )
+
+    def measure(self, func, rounds):
+        """
+        Best wall time of ``rounds`` calls, queries included
+        """
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,49 @@
+import asyncio
+import json
+
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Check poll_update fan-out through the configured channel layer: run '
+        '"listen" in one or more worker processes, then "send" from another'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('mode', choices=['listen', 'send'])
+        parser.add_argument('poll_id', type=int)
+        parser.add_argument('--data', default='{"choices": []}',
+                            help='JSON payload to send (send mode)')
+        parser.add_argument('--timeout', type=float, default=10.0,
+                            help='Seconds to wait for a message (listen mode)')
+
+    def handle(self, *args, **kwargs):
+        layer = get_channel_layer()
+        group = f"poll_{kwargs['poll_id']}"
+        if kwargs['mode'] == 'send':
+            asyncio.run(self.send(layer, group, json.loads(kwargs['data'])))
+        else:
+            asyncio.run(self.listen(layer, group, kwargs['timeout']))
+
+    async def send(self, layer, group, data):
+        await layer.group_send(group, {'type': 'poll_update', 'data': data})
+        self.stdout.write('sent')
+
+    async def listen(self, layer, group, timeout):
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        try:
+            # Subscribing may be lazy, so kick off the receive before announcing readiness
+            receive = asyncio.ensure_future(layer.receive(channel))
+            await asyncio.sleep(0.1)
+            self.stdout.write('ready')
+            self.stdout.flush()
+            try:
+                message = await asyncio.wait_for(receive, timeout)
+            except asyncio.TimeoutError:
+                raise CommandError(f'No poll_update received on {group} within {timeout}s')
+            self.stdout.write(json.dumps(message['data']))
+        finally:
+            await layer.group_discard(group, channel)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import Poll, VoteRollup
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-minute and hourly VoteRollup rows from the vote and archived vote tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll_ids', nargs='*', type=int,
+                            help='Only rebuild these polls (default: all)')
+
+    def handle(self, *args, **kwargs):
+        polls = Poll.objects.filter(pk__in=kwargs['poll_ids']) if kwargs['poll_ids'] else None
+        count = VoteRollup.rebuild(polls)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} vote rollups'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import Poll
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized Choice.votes and Poll.total_votes counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll_ids', nargs='*', type=int,
+                            help='Only reconcile these polls (default: all)')
+
+    def handle(self, *args, **kwargs):
+        polls = Poll.objects.all()
+        if kwargs['poll_ids']:
+            polls = polls.filter(pk__in=kwargs['poll_ids'])
+
+        num_polls, num_choices = polls.recount_votes()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Reconciled vote counters for {num_polls} polls and {num_choices} choices'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import PollStats
+
+
+class Command(BaseCommand):
+    help = 'Refresh the PollStats snapshot read by the dashboard (run periodically, e.g. from cron)'
+
+    def handle(self, *args, **kwargs):
+        count = PollStats.refresh()
+        self.stdout.write(self.style.SUCCESS(f'Refreshed stats for {count} polls'))
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:01
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_vote_counters(apps, schema_editor):
+    Poll = apps.get_model('polls', 'Poll')
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+
+    def vote_count(field):
+        votes = (
+            Vote.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+            .values('count')
+        )
+        return Coalesce(Subquery(votes, output_field=IntegerField()), Value(0))
+
+    Choice.objects.update(votes=vote_count('choice'))
+    Poll.objects.update(total_votes=vote_count('poll'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0002_alter_choice_choice_text_alter_choice_poll'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='total_votes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_vote_counters, migrations.RunPython.noop),
+    ]
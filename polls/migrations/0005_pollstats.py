@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:04
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_poll_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollStats',
+            fields=[
+                ('poll', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='polls.poll')),
+                ('unique_voters', models.IntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-unique_voters', '-poll'], name='pollstats_voters_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:11
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_votes(apps, schema_editor):
+    """
+    Keep each user's earliest vote per poll so the unique constraint can be
+    added, then recount the counters the deleted rows contributed to
+    """
+    Poll = apps.get_model('polls', 'Poll')
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+
+    duplicates = (
+        Vote.objects.order_by()
+        .values('user', 'poll')
+        .annotate(first_id=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+    )
+    poll_ids = set()
+    for row in duplicates:
+        Vote.objects.filter(user=row['user'], poll=row['poll']).exclude(id=row['first_id']).delete()
+        poll_ids.add(row['poll'])
+    if not poll_ids:
+        return
+
+    def vote_count(field):
+        votes = (
+            Vote.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(count=Count('pk'))
+            .values('count')
+        )
+        return Coalesce(Subquery(votes, output_field=IntegerField()), Value(0))
+
+    Choice.objects.filter(poll_id__in=poll_ids).update(votes=vote_count('choice'))
+    Poll.objects.filter(pk__in=poll_ids).update(total_votes=vote_count('poll'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_pollstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_votes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['poll', 'choice'], name='vote_poll_choice_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('user', 'poll'), name='unique_vote_per_user_poll'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_vote_unique_user_poll'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='poll',
+            name='modified_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='poll',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
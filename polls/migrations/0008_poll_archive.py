@@ -0,0 +1,61 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def freeze_ended_polls(apps, schema_editor):
+    Poll = apps.get_model('polls', 'Poll')
+    Choice = apps.get_model('polls', 'Choice')
+    PollResult = apps.get_model('polls', 'PollResult')
+
+    ended = Poll.objects.filter(active=False)
+    grouped = {pk: [] for pk in ended.values_list('pk', flat=True)}
+    choices = Choice.objects.filter(poll__in=ended).order_by('id').values_list(
+        'id', 'poll_id', 'choice_text', 'votes')
+    for pk, poll_id, text, votes in choices:
+        grouped[poll_id].append({'id': pk, 'choice_text': text, 'votes': votes})
+
+    results = []
+    for poll_id, rows in grouped.items():
+        total = sum(row['votes'] for row in rows)
+        for row in rows:
+            row['percentage'] = round(row['votes'] / total * 100, 1) if total > 0 else 0
+        results.append(PollResult(poll_id=poll_id, tally={'total_votes': total, 'choices': rows}))
+    PollResult.objects.bulk_create(results, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_poll_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollResult',
+            fields=[
+                ('poll', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='final_result', serialize=False, to='polls.poll')),
+                ('tally', models.JSONField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('votes_archived_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedVote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.poll')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['poll', 'choice'], name='archivedvote_poll_choice_idx')],
+            },
+        ),
+        migrations.RunPython(freeze_ended_polls, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:22
+
+import django.db.models.deletion
+from collections import Counter
+from datetime import timezone
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncHour
+
+
+def backfill_rollups(apps, schema_editor):
+    VoteRollup = apps.get_model('polls', 'VoteRollup')
+    counts = Counter()
+    for name in ('Vote', 'ArchivedVote'):
+        rows = (
+            apps.get_model('polls', name).objects.order_by()
+            .annotate(bucket=TruncHour('created_at', tzinfo=timezone.utc))
+            .values_list('poll_id', 'choice_id', 'bucket')
+            .annotate(count=Count('pk'))
+        )
+        for poll_id, choice_id, hour, count in rows:
+            counts[poll_id, choice_id, hour] += count
+    VoteRollup.objects.bulk_create(
+        [VoteRollup(poll_id=poll_id, choice_id=choice_id, hour=hour, votes=count)
+         for (poll_id, choice_id, hour), count in counts.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_poll_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('votes', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('poll', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.poll')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['poll', 'hour'], name='voterollup_poll_hour_idx')],
+                'constraints': [models.UniqueConstraint(fields=('choice', 'hour'), name='unique_rollup_choice_hour')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.1.4 on 2026-10-18 12:25
+
+from collections import Counter
+from datetime import timezone
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncMinute
+
+
+def backfill_minute_rollups(apps, schema_editor):
+    VoteRollup = apps.get_model('polls', 'VoteRollup')
+    counts = Counter()
+    for name in ('Vote', 'ArchivedVote'):
+        rows = (
+            apps.get_model('polls', name).objects.order_by()
+            .annotate(bucket=TruncMinute('created_at', tzinfo=timezone.utc))
+            .values_list('poll_id', 'choice_id', 'bucket')
+            .annotate(count=Count('pk'))
+        )
+        for poll_id, choice_id, bucket, count in rows:
+            counts[poll_id, choice_id, bucket] += count
+    VoteRollup.objects.bulk_create(
+        [VoteRollup(poll_id=poll_id, choice_id=choice_id, resolution='minute',
+                    bucket=bucket, votes=count)
+         for (poll_id, choice_id, bucket), count in counts.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_vote_rollup'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='voterollup',
+            name='unique_rollup_choice_hour',
+        ),
+        migrations.RemoveIndex(
+            model_name='voterollup',
+            name='voterollup_poll_hour_idx',
+        ),
+        migrations.RenameField(
+            model_name='voterollup',
+            old_name='hour',
+            new_name='bucket',
+        ),
+        migrations.AddField(
+            model_name='voterollup',
+            name='resolution',
+            field=models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour')], default='hour', max_length=6),
+        ),
+        migrations.AddIndex(
+            model_name='voterollup',
+            index=models.Index(fields=['poll', 'resolution', 'bucket'], name='voterollup_poll_bucket_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='voterollup',
+            constraint=models.UniqueConstraint(fields=('choice', 'resolution', 'bucket'), name='unique_rollup_choice_bucket'),
+        ),
+        migrations.RunPython(backfill_minute_rollups, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,70 @@
+from collections import Counter
+from datetime import timezone as dt_timezone
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce, TruncHour, TruncMinute
 from django.utils import timezone
 import secrets
 from django.urls import reverse
 
+from .versions import forget_poll_versions
+
+
+class PollQuerySet(models.QuerySet):
+    def with_listing_data(self, user=None):
+        """
+        Prepare polls for list pages: the owner is joined in, ``vote_count``
+        comes from the counter column and ``has_voted`` tells whether ``user``
+        already voted, so rendering a card needs no further queries
+        """
+        qs = self.select_related('owner').annotate(vote_count=F('total_votes'))
+        if user is not None and user.is_authenticated:
+            voted = Vote.objects.filter(poll=OuterRef('pk'), user=user)
+            return qs.annotate(has_voted=Exists(voted))
+        return qs.annotate(has_voted=Value(False))
+
+    def with_choices(self):
+        """
+        Prepare polls for the API: the owner and any frozen results are
+        joined in and all choices, whose ``votes`` counters carry the
+        tallies, are fetched in one extra query
+        """
+        return self.select_related('owner', 'final_result').prefetch_related(
+            Prefetch('choice_set', queryset=Choice.objects.order_by('id')))
+
+    def bump_version(self, **changes):
+        """
+        Apply ``changes`` and advance the polls' version stamp in one UPDATE
+        """
+        return self.update(version=F('version') + 1, modified_at=timezone.now(), **changes)
+
+    def recount_votes(self):
+        """
+        Recompute ``total_votes`` and the choices' ``votes`` counters for the
+        polls in this queryset with two bulk UPDATEs. Returns the number of
+        polls and choices updated.
+        """
+        def vote_count(field):
+            votes = (
+                Vote.objects.filter(**{field: OuterRef('pk')})
+                .order_by()
+                .values(field)
+                .annotate(count=Count('pk'))
+                .values('count')
+            )
+            return Coalesce(Subquery(votes, output_field=IntegerField()), Value(0))
+
+        # Polls whose votes were moved to ArchivedVote keep their final counts
+        polls = self.exclude(final_result__votes_archived_at__isnull=False)
+        with transaction.atomic():
+            num_choices = Choice.objects.filter(poll__in=polls.values('pk')).update(
+                votes=vote_count('choice'))
+            num_polls = polls.bump_version(total_votes=vote_count('poll'))
+            forget_poll_versions(polls.values_list('pk', flat=True))
+        return num_polls, num_choices
+
 
 class Poll(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -11,6 +72,43 @@ class Poll(models.Model):
     pub_date = models.DateTimeField(default=timezone.now)
     active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    total_votes = models.IntegerField(default=0)
+    # Bumped on every vote, edit or end; drives conditional GETs and caches
+    version = models.PositiveIntegerField(default=1)
+    modified_at = models.DateTimeField(default=timezone.now)
+
+    objects = PollQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'], name='poll_pub_date_id_idx'),
+            models.Index(fields=['-total_votes', '-id'], name='poll_total_votes_id_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored state so signal handlers can spot a poll ending
+        if 'active' in field_names:
+            instance._loaded_active = instance.active
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Save an edit and bump the version. ``total_votes`` and ``version``
+        are only ever changed with F() updates, so saving a stale instance
+        leaves them alone.
+        """
+        if self._state.adding or kwargs.get('update_fields') is not None:
+            return super().save(*args, **kwargs)
+        self.modified_at = timezone.now()
+        fields = [field.name for field in self._meta.concrete_fields
+                  if not field.primary_key and field.name not in ('total_votes', 'version')]
+        with transaction.atomic():
+            super().save(*args, update_fields=fields, **kwargs)
+            Poll.objects.filter(pk=self.pk).bump_version()
+            forget_poll_versions([self.pk])
+        self.refresh_from_db(fields=['total_votes', 'version', 'modified_at'])
 
     def user_can_vote(self):
         """
@@ -27,25 +125,21 @@ class Poll(models.Model):
 
     @property
     def get_vote_count(self):
-        return self.vote_set.count()
+        return self.total_votes
 
     def get_result_dict(self):
+        from .tally import tally_poll
+
+        alert_class = ['primary', 'secondary', 'success',
+                       'danger', 'dark', 'warning', 'info']
         res = []
-        for choice in self.choice_set.all():
-            d = {}
-            alert_class = ['primary', 'secondary', 'success',
-                           'danger', 'dark', 'warning', 'info']
-
-            d['alert_class'] = secrets.choice(alert_class)
-            d['text'] = choice.choice_text
-            d['num_votes'] = choice.get_vote_count
-            if not self.get_vote_count:
-                d['percentage'] = 0
-            else:
-                d['percentage'] = (choice.get_vote_count /
-                                   self.get_vote_count)*100
-
-            res.append(d)
+        for choice in tally_poll(self)['choices']:
+            res.append({
+                'alert_class': secrets.choice(alert_class),
+                'text': choice['choice_text'],
+                'num_votes': choice['votes'],
+                'percentage': choice['percentage'],
+            })
         return res
 
     def get_share_url(self):
@@ -65,7 +159,7 @@ class Choice(models.Model):
 
     @property
     def get_vote_count(self):
-        return self.vote_set.count()
+        return self.votes
 
     def __str__(self):
         return f"{self.poll.text[:25]} - {self.choice_text[:25]}"
@@ -78,5 +172,209 @@ class Vote(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            # Also serves as the (user, poll) index for "has voted" probes
+            models.UniqueConstraint(fields=['user', 'poll'], name='unique_vote_per_user_poll'),
+        ]
+        indexes = [
+            models.Index(fields=['poll', 'choice'], name='vote_poll_choice_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Insert the vote and bump the denormalized counters in one transaction
+        """
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                Choice.objects.filter(pk=self.choice_id).update(votes=F('votes') + 1)
+                Poll.objects.filter(pk=self.poll_id).bump_version(total_votes=F('total_votes') + 1)
+                forget_poll_versions([self.poll_id])
+                VoteRollup.record([(self.poll_id, self.choice_id, self.created_at)])
+
     def __str__(self):
         return f'{self.poll.text[:15]} - {self.choice.choice_text[:15]} - {self.user.username}'
+
+
+class PollStats(models.Model):
+    """
+    Periodically refreshed snapshot of per-poll voter statistics, read by the
+    dashboard instead of aggregating the vote table on every request
+    """
+    poll = models.OneToOneField(Poll, on_delete=models.CASCADE, primary_key=True,
+                                related_name='stats')
+    unique_voters = models.IntegerField(default=0)
+    refreshed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-unique_voters', '-poll'], name='pollstats_voters_idx'),
+        ]
+
+    @classmethod
+    def refresh(cls):
+        """
+        Recompute every poll's unique voter count in one aggregate query and
+        upsert the snapshot rows
+        """
+        now = timezone.now()
+        rows = (
+            Poll.objects.order_by()
+            .annotate(unique_voters=Count('vote__user', distinct=True))
+            .values_list('pk', 'unique_voters')
+        )
+        stats = [cls(poll_id=pk, unique_voters=voters, refreshed_at=now)
+                 for pk, voters in rows.iterator(chunk_size=2000)]
+        with transaction.atomic():
+            cls.objects.bulk_create(
+                stats,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['poll'],
+                update_fields=['unique_voters', 'refreshed_at'],
+            )
+        return len(stats)
+
+    def __str__(self):
+        return f'{self.poll} - {self.unique_voters} voters'
+
+
+class PollResult(models.Model):
+    """
+    Final tallies of an ended poll, frozen when it is closed so result pages,
+    the API and live clients stop reading the vote counters or table for it
+    """
+    poll = models.OneToOneField(Poll, on_delete=models.CASCADE, primary_key=True,
+                                related_name='final_result')
+    tally = models.JSONField()
+    archived_at = models.DateTimeField(default=timezone.now)
+    # Set once the poll's votes have been moved to ArchivedVote
+    votes_archived_at = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def freeze(cls, poll):
+        """
+        Snapshot the poll's exact tally from the vote table
+        """
+        from .tally import live_tally
+
+        result, _ = cls.objects.update_or_create(
+            poll_id=getattr(poll, 'pk', poll),
+            defaults={'tally': live_tally(poll), 'archived_at': timezone.now()},
+        )
+        return result
+
+    def __str__(self):
+        return f'{self.poll} - {self.tally["total_votes"]} votes'
+
+
+class ArchivedVote(models.Model):
+    """
+    Vote of an ended poll, moved out of the hot vote table by the
+    ``archive_votes`` command
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['poll', 'choice'], name='archivedvote_poll_choice_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.poll.text[:15]} - {self.choice.choice_text[:15]} - {self.user.username}'
+
+
+class VoteRollup(models.Model):
+    """
+    Votes per choice per minute and per hour, kept up to date as votes are
+    inserted and deleted so timelines and historical totals never scan the
+    vote table. Archived votes stay counted.
+    """
+    MINUTE = 'minute'
+    HOUR = 'hour'
+    RESOLUTIONS = [(MINUTE, 'Minute'), (HOUR, 'Hour')]
+
+    poll = models.ForeignKey(Poll, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    resolution = models.CharField(max_length=6, choices=RESOLUTIONS, default=HOUR)
+    bucket = models.DateTimeField()
+    votes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'resolution', 'bucket'],
+                                    name='unique_rollup_choice_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['poll', 'resolution', 'bucket'], name='voterollup_poll_bucket_idx'),
+        ]
+
+    @classmethod
+    def buckets(cls, moment):
+        """
+        Return ``(resolution, bucket start)`` pairs for a vote cast at ``moment``
+        """
+        minute = moment.astimezone(dt_timezone.utc).replace(second=0, microsecond=0)
+        return [(cls.MINUTE, minute), (cls.HOUR, minute.replace(minute=0))]
+
+    @classmethod
+    def record(cls, votes, sign=1):
+        """
+        Add ``sign`` to the buckets of every ``(poll_id, choice_id, created_at)``
+        in ``votes``, with one UPDATE per bucket touched
+        """
+        counts = Counter((poll_id, choice_id, resolution, bucket)
+                         for poll_id, choice_id, created_at in votes
+                         for resolution, bucket in cls.buckets(created_at))
+        for (poll_id, choice_id, resolution, bucket), count in counts.items():
+            rollup = cls.objects.filter(choice_id=choice_id, resolution=resolution, bucket=bucket)
+            if rollup.update(votes=F('votes') + sign * count) or sign < 0:
+                # A missing bucket has nothing to take a deleted vote from
+                continue
+            try:
+                with transaction.atomic():
+                    cls.objects.create(poll_id=poll_id, choice_id=choice_id, resolution=resolution,
+                                       bucket=bucket, votes=sign * count)
+            except IntegrityError:
+                # Created by a concurrent vote since the UPDATE
+                rollup.update(votes=F('votes') + sign * count)
+
+    @classmethod
+    def rebuild(cls, polls=None):
+        """
+        Recompute the rollups of ``polls`` (default: all) from the vote and
+        archived vote tables. Returns the number of buckets written.
+        """
+        counts = Counter()
+        for model in (Vote, ArchivedVote):
+            votes = model.objects.all()
+            if polls is not None:
+                votes = votes.filter(poll__in=polls)
+            for resolution, trunc in ((cls.MINUTE, TruncMinute), (cls.HOUR, TruncHour)):
+                rows = (
+                    votes.order_by()
+                    .annotate(bucket=trunc('created_at', tzinfo=dt_timezone.utc))
+                    .values_list('poll_id', 'choice_id', 'bucket')
+                    .annotate(count=Count('pk'))
+                )
+                for poll_id, choice_id, bucket, count in rows:
+                    counts[poll_id, choice_id, resolution, bucket] += count
+
+        rollups = [cls(poll_id=poll_id, choice_id=choice_id, resolution=resolution,
+                       bucket=bucket, votes=count)
+                   for (poll_id, choice_id, resolution, bucket), count in counts.items()]
+        with transaction.atomic():
+            stale = cls.objects.all()
+            if polls is not None:
+                stale = stale.filter(poll__in=polls)
+            stale.delete()
+            cls.objects.bulk_create(rollups, batch_size=1000)
+        return len(rollups)
+
+    def __str__(self):
+        return f'{self.choice} - {self.resolution} {self.bucket:%Y-%m-%d %H:%M} - {self.votes}'
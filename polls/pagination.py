@@ -0,0 +1,130 @@
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from rest_framework.pagination import CursorPagination
+
+
+class PollCursorPagination(CursorPagination):
+    ordering = ('-pub_date', '-id')
+
+
+class ChoiceCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+
+
+class VoteCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+
+
+class KeysetPage:
+    """
+    One page of a keyset-paginated queryset, exposing the same
+    ``has_previous``/``has_next`` interface the templates use for Django's
+    ``Page`` plus opaque cursors for the neighbouring pages
+    """
+
+    def __init__(self, object_list, previous_cursor, next_cursor):
+        self.object_list = object_list
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset by seeking past the last row seen instead of using
+    ``OFFSET``, so every page costs one indexed range scan and no ``COUNT``.
+
+    ``ordering`` is a sequence of field names (``-`` prefix for descending)
+    whose last entry must be unique, e.g. ``('-pub_date', '-id')``.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+
+    def encode_cursor(self, obj, reverse):
+        values = [getattr(obj, field) for field in self.fields]
+        payload = json.dumps([reverse, values], default=str)
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def _to_python(self, field, value):
+        try:
+            return self.queryset.model._meta.get_field(field).to_python(value)
+        except FieldDoesNotExist:
+            # Annotations such as counts are stored as plain JSON values
+            return value
+
+    def decode_cursor(self, cursor):
+        try:
+            reverse, values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = [self._to_python(field, value)
+                      for field, value in zip(self.fields, values)]
+        except Exception:
+            return None
+        if len(values) != len(self.fields):
+            return None
+        return bool(reverse), values
+
+    def _seek(self, values, reverse):
+        """
+        Build ``(a, b) > (x, y)`` style row comparisons, honouring the
+        direction of each ordering field
+        """
+        condition = Q()
+        equal = Q()
+        for name, value in zip(self.ordering, values):
+            field = name.lstrip('-')
+            descending = name.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def get_page(self, cursor=None):
+        position = self.decode_cursor(cursor) if cursor else None
+        reverse = False
+        queryset = self.queryset.order_by(*self.ordering)
+        if position is not None:
+            reverse, values = position
+            if reverse:
+                flipped = [name[1:] if name.startswith('-') else f'-{name}'
+                           for name in self.ordering]
+                queryset = queryset.order_by(*flipped)
+            queryset = queryset.filter(self._seek(values, reverse))
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        if not rows:
+            return KeysetPage(rows, None, None)
+
+        came_from_cursor = position is not None
+        has_next = has_more if not reverse else came_from_cursor
+        has_previous = came_from_cursor if not reverse else has_more
+        return KeysetPage(
+            rows,
+            self.encode_cursor(rows[0], reverse=True) if has_previous else None,
+            self.encode_cursor(rows[-1], reverse=False) if has_next else None,
+        )
@@ -0,0 +1,154 @@
+"""
+Versioned WebSocket protocol for live poll results.
+
+Version 1 (the default) sends the full ``{'choices': [...]}`` payload on
+connect and on every update.
+
+Version 2 clients connect with ``?protocol=2`` and receive::
+
+    {"type": "snapshot", "seq": 7, "choices": [{"id", "votes", "percentage"}, ...]}
+    {"type": "delta", "seq": 8, "base": 7, "choices": [{"id", "votes"}, ...]}
+
+``seq`` is the poll's ``Poll.version`` when the state was read, so it is
+shared by every worker process and only grows. A delta lists only the
+choices whose count changed since ``base``; clients recompute percentages
+themselves. A client whose last applied ``seq`` is not the delta's ``base``
+sends ``{"action": "resync"}`` and gets a new snapshot. Frames older than
+the client's state are ignored.
+Version 2 clients may add ``&encoding=msgpack`` to receive the same frames
+as binary msgpack messages.
+
+``poll_update`` events are encoded once by the sender (see
+``build_update_message``) and consumers forward the ready-made frame, so a
+broadcast costs one serialization per format rather than one per socket.
+
+The newest state of each poll is kept in the cache named by
+``POLL_STATE_CACHE``. Every broadcast refreshes it, so connecting clients
+are served from the cache and only the first connect after it expires
+tallies the poll. When workers race to record states, the cache can end up
+holding an older one than clients already have; the next delta then does
+not match their ``seq`` and they resync.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .tally import aversioned_tally, poll_update_data
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+LEGACY_VERSION = 1
+DELTA_VERSION = 2
+
+
+def _cache():
+    return caches[getattr(settings, 'POLL_STATE_CACHE', 'default')]
+
+
+def _key(poll_id):
+    return f'poll_state:{poll_id}'
+
+
+def _timeout():
+    return getattr(settings, 'POLL_STATE_TIMEOUT', 3600)
+
+
+def diff_choices(old, new):
+    """
+    Return the ``{'id', 'votes'}`` entries of ``new`` whose count differs
+    from ``old``, or ``None`` if the set of choices itself changed
+    """
+    old_votes = {choice['id']: choice['votes'] for choice in old['choices']}
+    if old_votes.keys() != {choice['id'] for choice in new['choices']}:
+        return None
+    return [
+        {'id': choice['id'], 'votes': choice['votes']}
+        for choice in new['choices']
+        if old_votes[choice['id']] != choice['votes']
+    ]
+
+
+def advance_state(poll_id, seq, data):
+    """
+    Record ``data``, the poll's state at version ``seq``, as its newest
+    state and return the ``seq``, ``data``, ``base`` and ``delta`` fields of
+    its ``poll_update`` message. If the cache already holds this or a newer
+    version, that state is returned whole instead.
+    """
+    cache = _cache()
+    previous = cache.get(_key(poll_id))
+    if previous and previous['seq'] >= seq:
+        return {'seq': previous['seq'], 'data': previous['data'], 'base': None, 'delta': None}
+    cache.set(_key(poll_id), {'seq': seq, 'data': data}, _timeout())
+    return {
+        'seq': seq,
+        'data': data,
+        'base': previous['seq'] if previous else None,
+        'delta': diff_choices(previous['data'], data) if previous else None,
+    }
+
+
+async def current_state(poll_id):
+    """
+    Return the poll's newest ``{'seq', 'data'}`` state, tallying and
+    recording it first if nothing is cached. Returns ``None`` for an
+    unknown poll.
+    """
+    state = await _cache().aget(_key(poll_id))
+    if state is None:
+        versioned = await aversioned_tally(poll_id)
+        if versioned is None:
+            return None
+        version, tally = versioned
+        advanced = await sync_to_async(advance_state)(poll_id, version, poll_update_data(tally))
+        state = {'seq': advanced['seq'], 'data': advanced['data']}
+    return state
+
+
+def snapshot_frame(seq, data):
+    return {'type': 'snapshot', 'seq': seq, 'choices': data['choices']}
+
+
+def update_frame(event):
+    """
+    Build the version 2 frame for a ``poll_update`` channel layer event
+    """
+    if event.get('delta') is None:
+        return snapshot_frame(event.get('seq'), event['data'])
+    return {
+        'type': 'delta',
+        'seq': event['seq'],
+        'base': event['base'],
+        'choices': event['delta'],
+    }
+
+
+def encode_frames(event):
+    """
+    Pre-encode ``event`` for every protocol variant, keyed by the names
+    ``PollConsumer`` uses to pick its frame
+    """
+    frame = update_frame(event)
+    frames = {
+        'v1': json.dumps(event['data']),
+        'v2': json.dumps(frame),
+    }
+    if msgpack is not None:
+        frames['v2-msgpack'] = msgpack.packb(frame)
+    return frames
+
+
+def build_update_message(poll_id, seq, data):
+    """
+    Return the channel layer ``poll_update`` event broadcasting ``data``,
+    the poll's state at version ``seq``
+    """
+    message = {'type': 'poll_update'}
+    message.update(advance_state(poll_id, seq, data))
+    message['frames'] = encode_frames(message)
+    return message
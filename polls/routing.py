@@ -3,4 +3,9 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/poll/(?P<poll_id>\w+)/$', consumers.PollConsumer.as_asgi()),
-] 
\ No newline at end of file
+]
+
+# Served by the ASGI application in front of Django's HTTP handler
+http_urlpatterns = [
+    re_path(r'^polls/(?P<poll_id>\d+)/stream/$', consumers.PollStreamConsumer.as_asgi()),
+]
@@ -1,18 +1,15 @@
 from rest_framework import serializers
-from .models import Poll, Choice, Vote
+from .models import Poll, Choice, Vote, PollResult
 
 class ChoiceSerializer(serializers.ModelSerializer):
-    votes_count = serializers.SerializerMethodField()
+    votes_count = serializers.IntegerField(source='votes', read_only=True)
 
     class Meta:
         model = Choice
         fields = ['id', 'choice_text', 'votes_count']
 
-    def get_votes_count(self, obj):
-        return obj.vote_set.count()
-
 class PollSerializer(serializers.ModelSerializer):
-    choices = ChoiceSerializer(many=True, read_only=True)
+    choices = ChoiceSerializer(many=True, read_only=True, source='choice_set')
     created_by = serializers.ReadOnlyField(source='owner.username')
 
     class Meta:
@@ -20,12 +17,103 @@ class PollSerializer(serializers.ModelSerializer):
         fields = ['id', 'text', 'created_by', 'pub_date', 'active', 'choices']
         read_only_fields = ['pub_date', 'active']
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if not instance.active:
+            try:
+                data['choices'] = snapshot_choices(instance.final_result.tally)
+            except PollResult.DoesNotExist:
+                pass
+        return data
+
 class VoteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Vote
         fields = ['id', 'choice', 'poll', 'user']
+        # The voter is always the requesting user; repeat votes are rejected
+        # by the database's unique (user, poll) constraint on insert
+        read_only_fields = ['user']
         
     def validate(self, attrs):
         if attrs['choice'].poll != attrs['poll']:
             raise serializers.ValidationError('Choice does not belong to poll')
-        return attrs 
\ No newline at end of file
+        if not attrs['poll'].active:
+            raise serializers.ValidationError('This poll is closed')
+        return attrs 
+
+class BulkVoteSerializer(serializers.Serializer):
+    """
+    One item of a bulk vote import. Only the shape is checked here; the
+    cross-row checks happen in polls.ingest against prefetched rows.
+    """
+    user = serializers.IntegerField()
+    poll = serializers.IntegerField()
+    choice = serializers.IntegerField()
+
+
+# Read-only fast paths for the list endpoints. They build the same dicts as
+# the serializers above straight from ``.values()`` rows, skipping per-field
+# serializer dispatch, which dominates large list responses.
+
+_datetime_field = serializers.DateTimeField()
+
+POLL_LIST_FIELDS = ('id', 'text', 'owner__username', 'pub_date', 'active', 'final_result__tally')
+VOTE_LIST_FIELDS = ('id', 'choice_id', 'poll_id', 'user_id', 'created_at')
+
+
+def snapshot_choices(tally):
+    """
+    Shape a frozen ``PollResult.tally`` like ``ChoiceSerializer`` output
+    """
+    return [
+        {'id': choice['id'], 'choice_text': choice['choice_text'], 'votes_count': choice['votes']}
+        for choice in tally['choices']
+    ]
+
+
+def poll_list_data(rows):
+    """
+    Return ``PollSerializer(many=True).data`` for ``.values(*POLL_LIST_FIELDS)``
+    rows, fetching the choices of polls without frozen results in one query
+    """
+    choices = {}
+    live = []
+    for row in rows:
+        if not row['active'] and row['final_result__tally'] is not None:
+            choices[row['id']] = snapshot_choices(row['final_result__tally'])
+        else:
+            choices[row['id']] = []
+            live.append(row['id'])
+    choice_rows = (
+        Choice.objects.filter(poll_id__in=live)
+        .order_by('id')
+        .values('id', 'poll_id', 'choice_text', 'votes')
+    )
+    for choice in choice_rows:
+        choices[choice['poll_id']].append({
+            'id': choice['id'],
+            'choice_text': choice['choice_text'],
+            'votes_count': choice['votes'],
+        })
+    return [
+        {
+            'id': row['id'],
+            'text': row['text'],
+            'created_by': row['owner__username'],
+            'pub_date': _datetime_field.to_representation(row['pub_date']),
+            'active': row['active'],
+            'choices': choices[row['id']],
+        }
+        for row in rows
+    ]
+
+
+def vote_list_data(rows):
+    """
+    Return ``VoteSerializer(many=True).data`` for ``.values(*VOTE_LIST_FIELDS)``
+    rows
+    """
+    return [
+        {'id': row['id'], 'choice': row['choice_id'], 'poll': row['poll_id'], 'user': row['user_id']}
+        for row in rows
+    ]
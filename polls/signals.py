@@ -0,0 +1,117 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .broadcast import broadcaster
+from .models import Poll, Choice, Vote, PollResult, VoteRollup
+from .stats import adjust_site_stats, recount_site_votes
+from .versions import forget_poll_versions
+
+
+_frozen = threading.local()
+
+
+def _adjust_on_commit(**deltas):
+    transaction.on_commit(lambda: adjust_site_stats(**deltas))
+
+
+def _reconcile_deleted_votes(batch):
+    if batch['done']:
+        return
+    batch['done'] = True
+    polls = Poll.objects.filter(pk__in=batch['polls'])
+    poll_ids = list(polls.values_list('pk', flat=True))
+    if poll_ids:
+        polls.recount_votes()
+        VoteRollup.rebuild(polls=poll_ids)
+    recount_site_votes()
+    for poll_id in poll_ids:
+        broadcaster.notify(poll_id)
+
+
+@contextmanager
+def vote_counters_frozen():
+    """
+    Leave every vote counter as it is while votes are deleted in this
+    thread, for callers that keep the final numbers on purpose (see the
+    ``archive_votes`` command)
+    """
+    _frozen.active = True
+    try:
+        yield
+    finally:
+        _frozen.active = False
+
+
+@receiver(post_delete, sender=Vote)
+def decrement_vote_counters(sender, instance, origin=None, **kwargs):
+    # post_delete also fires for cascades and queryset deletes, which never
+    # call Vote.delete(), so the counters are kept in sync here instead.
+    if getattr(_frozen, 'active', False):
+        return
+    if not isinstance(origin, Vote):
+        # Bulk and cascaded deletes: reconcile the affected polls once after
+        # commit rather than adjusting every counter per vote. Polls being
+        # deleted themselves need nothing but the site stats.
+        batch = getattr(origin, '_vote_delete_batch', None)
+        if batch is None or batch['done']:
+            batch = {'polls': set(), 'done': False}
+            setattr(origin, '_vote_delete_batch', batch)
+        if not isinstance(origin, Poll) and getattr(origin, 'model', None) is not Poll:
+            batch['polls'].add(instance.poll_id)
+        # Registered per vote so a batch left behind by a rolled back
+        # delete is still picked up; only the first callback does the work
+        transaction.on_commit(lambda: _reconcile_deleted_votes(batch))
+        return
+
+    Choice.objects.filter(pk=instance.choice_id).update(votes=F('votes') - 1)
+    Poll.objects.filter(pk=instance.poll_id).bump_version(total_votes=F('total_votes') - 1)
+    forget_poll_versions([instance.poll_id])
+    VoteRollup.record([(instance.poll_id, instance.choice_id, instance.created_at)], sign=-1)
+    _adjust_on_commit(total_votes=-1)
+    transaction.on_commit(lambda: broadcaster.notify(instance.poll_id))
+
+
+@receiver(post_save, sender=Vote)
+def count_new_vote(sender, instance, created, **kwargs):
+    if created:
+        _adjust_on_commit(total_votes=1)
+        transaction.on_commit(lambda: broadcaster.notify(instance.poll_id))
+
+
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def bump_poll_version_on_choice_change(sender, instance, **kwargs):
+    Poll.objects.filter(pk=instance.poll_id).bump_version()
+    forget_poll_versions([instance.poll_id])
+    # Replaces the cached protocol state, which still lists the old choices
+    transaction.on_commit(lambda: broadcaster.notify(instance.poll_id))
+
+
+@receiver(post_save, sender=Poll)
+def freeze_results_on_end(sender, instance, created, **kwargs):
+    # Runs before count_poll_changes, which resets _loaded_active
+    was_active = getattr(instance, '_loaded_active', None)
+    if not instance.active and (created or was_active):
+        PollResult.freeze(instance)
+    elif instance.active and was_active is False:
+        PollResult.objects.filter(poll=instance).delete()
+
+
+@receiver(post_save, sender=Poll)
+def count_poll_changes(sender, instance, created, **kwargs):
+    was_active = getattr(instance, '_loaded_active', None)
+    instance._loaded_active = instance.active
+    if created:
+        _adjust_on_commit(total_polls=1, total_completed_polls=int(not instance.active))
+    elif was_active is not None and was_active != instance.active:
+        _adjust_on_commit(total_completed_polls=1 if was_active else -1)
+
+
+@receiver(post_delete, sender=Poll)
+def count_deleted_poll(sender, instance, **kwargs):
+    _adjust_on_commit(total_polls=-1, total_completed_polls=-int(not instance.active))
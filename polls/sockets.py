@@ -0,0 +1,82 @@
+"""
+Backpressure and subscriber limits for ``PollConsumer`` sockets.
+
+``poll_update`` only queues a socket's frame; a task per socket sends it.
+When the ASGI server blocks ``send`` for a client on a slow network, frames
+wait in that socket's queue instead of holding up its channel. Once
+``POLL_SOCKET_QUEUE_LIMIT`` frames are waiting they are dropped and replaced
+by a single snapshot of the newest state, so a slow client skips the
+intermediate updates rather than falling further behind.
+
+``POLL_MAX_SUBSCRIBERS`` caps the sockets a worker process holds per poll;
+further handshakes are rejected. Counts are kept per process, so a
+deployment accepts up to this many sockets per poll in each worker.
+"""
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+STATS = ('queued', 'sent', 'dropped', 'rejected')
+
+
+class SocketRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._polls = {}
+        self._stats = Counter()
+
+    @property
+    def max_subscribers(self):
+        return getattr(settings, 'POLL_MAX_SUBSCRIBERS', None)
+
+    def join(self, poll_id):
+        """
+        Register a socket for ``poll_id``. Returns False, without
+        registering it, when the poll already has ``POLL_MAX_SUBSCRIBERS``
+        sockets in this process.
+        """
+        limit = self.max_subscribers
+        with self._lock:
+            stats = self._polls.get(poll_id)
+            if limit and stats is not None and stats['connected'] >= limit:
+                self._stats['rejected'] += 1
+                stats['rejected'] += 1
+                return False
+            if stats is None:
+                stats = self._polls[poll_id] = Counter()
+            stats['connected'] += 1
+            return True
+
+    def leave(self, poll_id):
+        with self._lock:
+            stats = self._polls.get(poll_id)
+            if stats is None:
+                return
+            stats['connected'] -= 1
+            if stats['connected'] <= 0:
+                del self._polls[poll_id]
+
+    def record(self, poll_id, name, count=1):
+        with self._lock:
+            self._stats[name] += count
+            if poll_id in self._polls:
+                self._polls[poll_id][name] += count
+
+    def metrics(self):
+        """
+        Totals of queued, sent, dropped and rejected frames and handshakes,
+        plus the connected sockets and their counts for each poll that
+        currently has sockets in this process
+        """
+        with self._lock:
+            metrics = {name: self._stats[name] for name in STATS}
+            metrics['connected'] = sum(stats['connected'] for stats in self._polls.values())
+            metrics['polls'] = {
+                str(poll_id): {name: stats[name] for name in ('connected',) + STATS}
+                for poll_id, stats in self._polls.items()
+            }
+        return metrics
+
+
+socket_registry = SocketRegistry()
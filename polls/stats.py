@@ -0,0 +1,73 @@
+"""
+Site-wide counters shown on the home page.
+
+The counters live in the cache configured by ``SITE_STATS_CACHE`` and are
+adjusted in place by the signal handlers in ``polls.signals`` as polls and
+votes come and go. Each entry expires after ``SITE_STATS_TTL`` seconds, at
+which point the next read recomputes all of them from the database, so any
+drift (e.g. from ``QuerySet.update`` calls that bypass signals) is bounded.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Poll, Vote, ArchivedVote
+
+KEY_PREFIX = 'site_stats'
+STAT_NAMES = ('total_polls', 'total_votes', 'total_completed_polls')
+
+
+def _cache():
+    return caches[getattr(settings, 'SITE_STATS_CACHE', 'default')]
+
+
+def _key(name):
+    return f'{KEY_PREFIX}:{name}'
+
+
+def _vote_total():
+    # Votes moved out by ``archive_votes`` still count
+    return Vote.objects.count() + ArchivedVote.objects.count()
+
+
+def recompute_site_stats():
+    stats = {
+        'total_polls': Poll.objects.count(),
+        'total_votes': _vote_total(),
+        'total_completed_polls': Poll.objects.filter(active=False).count(),
+    }
+    _cache().set_many(
+        {_key(name): value for name, value in stats.items()},
+        timeout=getattr(settings, 'SITE_STATS_TTL', 300),
+    )
+    return stats
+
+
+def recount_site_votes():
+    """
+    Reset the cached vote total from the vote tables, after deletes too
+    large to adjust vote by vote
+    """
+    _cache().set(_key('total_votes'), _vote_total(),
+                 timeout=getattr(settings, 'SITE_STATS_TTL', 300))
+
+
+def get_site_stats():
+    cached = _cache().get_many([_key(name) for name in STAT_NAMES])
+    if len(cached) != len(STAT_NAMES):
+        return recompute_site_stats()
+    return {name: cached[_key(name)] for name in STAT_NAMES}
+
+
+def adjust_site_stats(**deltas):
+    """
+    Apply ``name=delta`` increments to the cached counters. Counters that
+    are not cached are left alone; the next read rebuilds them.
+    """
+    cache = _cache()
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(_key(name), delta)
+        except ValueError:
+            pass
@@ -0,0 +1,155 @@
+"""
+Poll result tallies shared by the views, the WebSocket consumer and the API.
+
+Every function here costs a single query regardless of how many choices a
+poll has. By default counts come from the denormalized ``Choice.votes``
+counters; pass ``exact=True`` to aggregate the ``Vote`` table instead with
+a single ``GROUP BY`` over the poll's choices.
+
+Ended polls are served from their frozen ``PollResult`` snapshot. When only
+poll ids are given, that costs one extra primary key lookup.
+
+``atally_poll`` is the async ORM variant used by async views and consumers.
+
+``versioned_tally`` pairs a poll's tally with its ``Poll.version``, read
+together in one query, for the live-update protocol (see ``polls.protocol``).
+"""
+from collections import defaultdict
+
+from django.db.models import Count
+
+from .models import Choice, Poll, PollResult
+
+
+def _percentage(votes, total):
+    return round(votes / total * 100, 1) if total > 0 else 0
+
+
+def _build(rows):
+    total_votes = sum(row['votes'] for row in rows)
+    for row in rows:
+        row['percentage'] = _percentage(row['votes'], total_votes)
+    return {'total_votes': total_votes, 'choices': rows}
+
+
+def _choice_rows(poll_ids, exact):
+    choices = Choice.objects.filter(poll_id__in=poll_ids).order_by('id')
+    if exact:
+        choices = choices.annotate(vote_count=Count('vote'))
+        return [
+            {'id': pk, 'poll_id': poll_id, 'choice_text': text, 'votes': votes}
+            for pk, poll_id, text, votes in choices.values_list(
+                'id', 'poll_id', 'choice_text', 'vote_count')
+        ]
+    return list(choices.values('id', 'poll_id', 'choice_text', 'votes'))
+
+
+def _frozen_tallies(polls):
+    """
+    Return ``{poll_id: tally}`` for the ended polls among ``polls``. Poll
+    instances that are still active are not looked up.
+    """
+    candidates = [getattr(poll, 'pk', poll) for poll in polls
+                  if not getattr(poll, 'active', False)]
+    if not candidates:
+        return {}
+    return dict(PollResult.objects.filter(poll_id__in=candidates).values_list('poll_id', 'tally'))
+
+
+def tally_polls(polls, exact=False):
+    """
+    Tally several polls at once, returning ``{poll_id: tally}``
+    """
+    poll_ids = [getattr(poll, 'pk', poll) for poll in polls]
+    tallies = _frozen_tallies(polls)
+    live_ids = [poll_id for poll_id in poll_ids if poll_id not in tallies]
+    if live_ids:
+        grouped = defaultdict(list)
+        for row in _choice_rows(live_ids, exact):
+            grouped[row.pop('poll_id')].append(row)
+        tallies.update((poll_id, _build(grouped[poll_id])) for poll_id in live_ids)
+    return {poll_id: tallies[poll_id] for poll_id in poll_ids}
+
+
+def live_tally(poll):
+    """
+    Aggregate the poll's tally from the vote table, ignoring any snapshot
+    """
+    poll_id = getattr(poll, 'pk', poll)
+    return _build([{key: value for key, value in row.items() if key != 'poll_id'}
+                   for row in _choice_rows([poll_id], exact=True)])
+
+
+def tally_poll(poll, exact=False):
+    """
+    Return ``{'total_votes': int, 'choices': [...]}`` for one poll, where
+    each choice is a dict with ``id``, ``choice_text``, ``votes`` and
+    ``percentage`` keys
+    """
+    return tally_polls([poll], exact=exact)[getattr(poll, 'pk', poll)]
+
+
+async def atally_poll(poll):
+    """
+    Async ``tally_poll()`` for a poll instance, reading the denormalized
+    counters (or the frozen snapshot) through the async ORM
+    """
+    if not poll.active:
+        tally = await PollResult.objects.filter(poll_id=poll.pk).values_list(
+            'tally', flat=True).afirst()
+        if tally is not None:
+            return tally
+    choices = Choice.objects.filter(poll_id=poll.pk).order_by('id')
+    return _build([row async for row in choices.values('id', 'choice_text', 'votes')])
+
+
+def _versioned_rows(poll_id):
+    return Poll.objects.filter(pk=poll_id).order_by('choice_set__id').values(
+        'version', 'active', 'final_result__tally',
+        'choice_set__id', 'choice_set__choice_text', 'choice_set__votes')
+
+
+def _versioned(rows):
+    if not rows:
+        return None
+    poll = rows[0]
+    if not poll['active'] and poll['final_result__tally'] is not None:
+        return poll['version'], poll['final_result__tally']
+    return poll['version'], _build([
+        {'id': row['choice_set__id'], 'choice_text': row['choice_set__choice_text'],
+         'votes': row['choice_set__votes']}
+        for row in rows if row['choice_set__id'] is not None
+    ])
+
+
+def versioned_tally(poll_id):
+    """
+    Return ``(version, tally)`` for one poll, or ``None`` if it does not
+    exist. Both come from the same query, so the tally is exactly the state
+    stamped with that version.
+    """
+    return _versioned(list(_versioned_rows(poll_id)))
+
+
+async def aversioned_tally(poll_id):
+    """
+    Async ``versioned_tally()``
+    """
+    return _versioned([row async for row in _versioned_rows(poll_id)])
+
+
+def poll_update_data(tally):
+    """
+    Shape a tally into the ``{'choices': [...]}`` payload sent to
+    ``PollConsumer`` clients
+    """
+    return {
+        'choices': [
+            {
+                'id': choice['id'],
+                'votes': choice['votes'],
+                'percentage': choice['percentage'],
+            }
+            for choice in tally['choices']
+        ]
+    }
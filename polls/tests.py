@@ -1,9 +1,72 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+from io import StringIO
+from unittest import mock, skipUnless
+
 from django.contrib.auth import authenticate
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
-from .models import Poll, Vote
+try:
+    import channels_redis
+    from fakeredis import TcpFakeServer
+except ImportError:
+    channels_redis = TcpFakeServer = None
+
+try:
+    # channels.testing needs daphne installed
+    from channels.testing import WebsocketCommunicator
+except ImportError:
+    WebsocketCommunicator = None
+
+from .models import Poll, Choice, Vote, PollStats, PollResult, ArchivedVote, VoteRollup
+from .broadcast import PollBroadcaster, broadcaster
+from .buffer import VoteBuffer
+from .pagination import KeysetPaginator
+from .consumers import PollConsumer, load_state
+from .protocol import (
+    DELTA_VERSION, advance_state, build_update_message, current_state, diff_choices, msgpack,
+)
+from .ingest import ingest_votes
+from .routing import http_urlpatterns, websocket_urlpatterns
+from .serializers import PollSerializer, VoteSerializer
+from .sockets import SocketRegistry
+from .stats import get_site_stats
+from .tally import tally_poll, tally_polls, versioned_tally
+from .timeline import poll_timeline
+
+
+@override_settings(POLL_BROADCAST_WINDOW=0)
+class LunchPollTestCase(TestCase):
+    """
+    Starts each test with empty caches and an active 'Lunch?' poll by
+    ``owner`` with ``pizza`` and ``sushi`` choices, plus a ``voter``.
+    Broadcasts are sent as soon as they are committed, so no test leaves
+    the coalescing thread running.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('owner')
+        self.voter = User.objects.create_user('voter')
+        self.poll = Poll.objects.create(owner=self.owner, text='Lunch?')
+        self.pizza = self.poll.choice_set.create(choice_text='pizza')
+        self.sushi = self.poll.choice_set.create(choice_text='sushi')
 
 
 class PollModelTest(TestCase):
@@ -17,6 +80,945 @@ class PollModelTest(TestCase):
         self.assertFalse(poll.user_can_vote(user))
 
 
+class VoteCounterTest(LunchPollTestCase):
+    def test_counters_follow_votes(self):
+        vote = Vote.objects.create(user=self.voter, poll=self.poll, choice=self.pizza)
+        self.poll.refresh_from_db()
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.poll.total_votes, 1)
+        self.assertEqual(self.pizza.votes, 1)
+
+        vote.delete()
+        self.poll.refresh_from_db()
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.poll.total_votes, 0)
+        self.assertEqual(self.pizza.votes, 0)
+
+    def test_cascaded_vote_deletes_are_reconciled_once(self):
+        other = Poll.objects.create(owner=self.voter, text='Dinner?')
+        other_choice = other.choice_set.create(choice_text='soup')
+        voters = [User.objects.create_user(f'voter{n}') for n in range(20)]
+        for voter in voters:
+            Vote.objects.create(user=voter, poll=self.poll, choice=self.pizza)
+        Vote.objects.create(user=voters[0], poll=other, choice=other_choice)
+
+        with CaptureQueriesContext(connection) as ctx:
+            with self.captureOnCommitCallbacks(execute=True):
+                voters[0].delete()
+        self.assertLess(len(ctx.captured_queries), 40)
+        self.poll.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.poll.total_votes, other.total_votes), (19, 0))
+        self.assertEqual(VoteRollup.objects.filter(
+            poll=self.poll, resolution=VoteRollup.HOUR).get().votes, 19)
+
+        with CaptureQueriesContext(connection) as ctx:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.poll.delete()
+        self.assertLess(len(ctx.captured_queries), 30)
+        self.assertEqual(get_site_stats()['total_votes'], 0)
+
+    def test_reading_counts_runs_no_queries(self):
+        Vote.objects.create(user=self.voter, poll=self.poll, choice=self.sushi)
+        poll = Poll.objects.get(pk=self.poll.pk)
+        choices = list(poll.choice_set.all())
+        with self.assertNumQueries(0):
+            self.assertEqual(poll.get_vote_count, 1)
+            self.assertEqual([c.get_vote_count for c in choices], [0, 1])
+
+    def test_recount_votes_command(self):
+        Vote.objects.create(user=self.voter, poll=self.poll, choice=self.sushi)
+        Poll.objects.update(total_votes=42)
+        Choice.objects.update(votes=7)
+
+        call_command('recount_votes', stdout=StringIO())
+
+        self.poll.refresh_from_db()
+        self.assertEqual(self.poll.total_votes, 1)
+        self.assertEqual(
+            dict(self.poll.choice_set.values_list('choice_text', 'votes')),
+            {'pizza': 0, 'sushi': 1},
+        )
+
+
+class TallyTest(LunchPollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Poll.objects.create(owner=self.owner, text='Dinner?')
+        self.other.choice_set.create(choice_text='soup')
+        for name in ('a', 'b', 'c'):
+            user = User.objects.create_user(name)
+            Vote.objects.create(user=user, poll=self.poll, choice=self.pizza)
+
+    def test_tally_poll(self):
+        for exact in (False, True):
+            with self.assertNumQueries(1):
+                results = tally_poll(self.poll, exact=exact)
+            self.assertEqual(results['total_votes'], 3)
+            self.assertEqual(
+                [(c['choice_text'], c['votes'], c['percentage']) for c in results['choices']],
+                [('pizza', 3, 100.0), ('sushi', 0, 0)],
+            )
+
+    def test_tally_polls_batches_into_one_query(self):
+        with self.assertNumQueries(1):
+            results = tally_polls([self.poll, self.other])
+        self.assertEqual(results[self.poll.pk]['total_votes'], 3)
+        self.assertEqual(results[self.other.pk]['total_votes'], 0)
+        self.assertEqual(len(results[self.other.pk]['choices']), 1)
+
+
+class OneVotePerPollTest(LunchPollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.voter)
+
+    def test_repeat_vote_is_rejected_by_the_database(self):
+        url = f'/polls/{self.poll.pk}/vote/'
+        self.client.post(url, {'choice': self.pizza.pk})
+        response = self.client.post(url, {'choice': self.sushi.pk}, follow=True)
+
+        self.assertContains(response, 'You have already voted on this poll!')
+        self.assertEqual(Vote.objects.filter(poll=self.poll).count(), 1)
+        self.poll.refresh_from_db()
+        self.assertEqual(self.poll.total_votes, 1)
+
+    def test_api_repeat_votes_return_400(self):
+        first = self.client.post(f'/polls/api/choices/{self.pizza.pk}/vote/')
+        self.assertEqual(first.status_code, 200)
+        again = self.client.post(f'/polls/api/choices/{self.sushi.pk}/vote/')
+        self.assertEqual(again.status_code, 400)
+
+        response = self.client.post('/polls/api/votes/', {'poll': self.poll.pk, 'choice': self.sushi.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Vote.objects.count(), 1)
+
+
+@override_settings(BULK_VOTE_CHUNK_SIZE=2)
+class BulkVoteTest(LunchPollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_user('admin', is_staff=True)
+        self.client.force_login(self.admin)
+        closed = Poll.objects.create(owner=self.owner, text='Closed', active=False)
+        self.closed_choice = closed.choice_set.create(choice_text='nope')
+        self.voters = [User.objects.create_user(f'voter{i}') for i in range(4)]
+
+    def vote(self, user, choice):
+        return {'user': user.pk, 'poll': choice.poll_id, 'choice': choice.pk}
+
+    def test_bulk_import_reports_each_item(self):
+        Vote.objects.create(user=self.voters[3], poll=self.poll, choice=self.pizza)
+        payload = [
+            self.vote(self.voters[0], self.pizza),
+            self.vote(self.voters[1], self.sushi),
+            self.vote(self.voters[1], self.pizza),
+            self.vote(self.voters[2], self.closed_choice),
+            {'user': self.voters[2].pk, 'poll': self.poll.pk, 'choice': self.closed_choice.pk},
+            self.vote(self.voters[3], self.sushi),
+            {'user': 'nobody'},
+            self.vote(self.voters[2], self.sushi),
+        ]
+        response = self.client.post('/polls/api/votes/bulk/', payload, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [result['status'] for result in response.data['results']],
+            ['created', 'created', 'duplicate', 'invalid', 'invalid',
+             'already_voted', 'invalid', 'created'],
+        )
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual(
+            dict(self.poll.choice_set.values_list('choice_text', 'votes')),
+            {'pizza': 2, 'sushi': 2},
+        )
+        self.poll.refresh_from_db()
+        self.assertEqual(self.poll.total_votes, 4)
+
+    def test_votes_lost_to_a_concurrent_insert_are_not_counted(self):
+        # Stored after ingest_votes checked for existing votes
+        Vote.objects.create(user=self.voters[0], poll=self.poll, choice=self.pizza)
+        cache.clear()
+        get_site_stats()
+        with mock.patch('polls.ingest._existing_votes', return_value=set()), \
+                self.captureOnCommitCallbacks(execute=True):
+            results = ingest_votes([self.vote(self.voters[0], self.sushi),
+                                    self.vote(self.voters[1], self.sushi)])
+
+        self.assertEqual([result['status'] for result in results], ['already_voted', 'created'])
+        self.assertEqual(get_site_stats()['total_votes'], 2)
+        self.assertEqual(
+            dict(VoteRollup.objects.filter(resolution=VoteRollup.HOUR)
+                 .values_list('choice__choice_text', 'votes')),
+            {'pizza': 1, 'sushi': 1},
+        )
+
+    def test_ingest_adds_to_counters_instead_of_recounting(self):
+        # A vote counted by another request that this transaction cannot see
+        Choice.objects.filter(pk=self.pizza.pk).update(votes=F('votes') + 1)
+        Poll.objects.filter(pk=self.poll.pk).update(total_votes=F('total_votes') + 1)
+
+        ingest_votes([self.vote(self.voters[0], self.pizza), self.vote(self.voters[1], self.pizza),
+                      self.vote(self.voters[2], self.sushi)])
+
+        self.assertEqual(
+            dict(self.poll.choice_set.values_list('choice_text', 'votes')),
+            {'pizza': 3, 'sushi': 1},
+        )
+        self.poll.refresh_from_db()
+        self.assertEqual(self.poll.total_votes, 4)
+
+    def test_bulk_import_requires_staff(self):
+        self.client.force_login(self.voters[0])
+        response = self.client.post('/polls/api/votes/bulk/', [], content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(VOTE_INGEST_MODE='buffered', VOTE_BUFFER_FLUSH_INTERVAL=60,
+                   VOTE_BUFFER_MAX_SIZE=2)
+class VoteBufferTest(LunchPollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.voters = [User.objects.create_user(f'voter{i}') for i in range(3)]
+        self.buffer = VoteBuffer()
+        patcher = mock.patch('polls.views.vote_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def vote(self, user):
+        self.client.force_login(user)
+        response = self.client.post(f'/polls/{self.poll.pk}/vote/', {'choice': self.pizza.pk}, follow=True)
+        return [str(message) for message in response.context['messages']]
+
+    def test_votes_are_written_on_flush(self):
+        self.assertEqual(self.vote(self.voters[0]), ['Your vote has been recorded!'])
+        self.assertEqual(self.vote(self.voters[0]), ['You have already voted on this poll!'])
+        self.vote(self.voters[1])
+        self.assertFalse(Vote.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buffer.flush()
+
+        self.assertEqual(Vote.objects.count(), 2)
+        self.pizza.refresh_from_db()
+        self.assertEqual(self.pizza.votes, 2)
+        self.assertEqual(self.buffer.metrics()['flushed'], 2)
+        self.assertEqual(self.buffer.metrics()['waiting'], 0)
+
+    def test_vote_already_in_the_database_is_rejected(self):
+        Vote.objects.create(user=self.voters[0], poll=self.poll, choice=self.pizza)
+        self.assertEqual(self.vote(self.voters[0]), ['You have already voted on this poll!'])
+        self.assertEqual(self.buffer.metrics()['queued'], 0)
+
+    def test_full_buffer_rejects_votes(self):
+        self.vote(self.voters[0])
+        self.vote(self.voters[1])
+        self.assertEqual(self.vote(self.voters[2]),
+                         ['Voting is busy right now, please try again in a moment.'])
+        self.assertEqual(self.buffer.metrics()['rejected'], 1)
+
+
+class PollListQueryTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='john', password='rambo')
+        self.client.force_login(self.user)
+
+    def create_polls(self, count):
+        for i in range(count):
+            owner = User.objects.create_user(f'owner{Poll.objects.count()}')
+            poll = Poll.objects.create(owner=owner, text=f'Poll {i}')
+            choice = poll.choice_set.create(choice_text='yes')
+            Vote.objects.create(user=self.user, poll=poll, choice=choice)
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/polls/list/?vote=1')
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_independent_of_page_size(self):
+        self.create_polls(1)
+        one_poll = self.count_list_queries()
+        self.create_polls(5)
+        self.assertEqual(self.count_list_queries(), one_poll)
+
+    def count_api_queries(self):
+        self.client.logout()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/polls/api/polls/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], len(ctx.captured_queries)
+
+    def test_api_list_prefetches_choices(self):
+        self.create_polls(1)
+        results, one_poll = self.count_api_queries()
+        self.assertEqual(results[0]['choices'], [
+            {'id': Choice.objects.get().pk, 'choice_text': 'yes', 'votes_count': 1},
+        ])
+        self.assertEqual(results[0]['created_by'], 'owner0')
+        self.create_polls(5)
+        results, six_polls = self.count_api_queries()
+        self.assertEqual(len(results), 6)
+        self.assertEqual(six_polls, one_poll)
+
+    def test_listing_annotations(self):
+        self.create_polls(1)
+        poll = Poll.objects.with_listing_data(self.user).get()
+        self.assertEqual(poll.vote_count, 1)
+        self.assertTrue(poll.has_voted)
+
+
+class FastListSerializerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('voter')
+        for i in range(3):
+            owner = User.objects.create_user(f'owner{i}')
+            poll = Poll.objects.create(owner=owner, text=f'Poll {i}')
+            for text in ('yes', 'no'):
+                poll.choice_set.create(choice_text=text)
+            Vote.objects.create(user=self.user, poll=poll, choice=poll.choice_set.first())
+        self.client.force_login(self.user)
+
+    def test_poll_list_matches_serializer(self):
+        response = self.client.get('/polls/api/polls/')
+        expected = PollSerializer(
+            Poll.objects.with_choices().order_by('-pub_date', '-id'), many=True).data
+        self.assertEqual(json.loads(json.dumps(response.data['results'])),
+                         json.loads(json.dumps(expected)))
+
+    def test_vote_list_matches_serializer(self):
+        response = self.client.get('/polls/api/votes/')
+        expected = VoteSerializer(Vote.objects.order_by('-created_at', '-id'), many=True).data
+        self.assertEqual(response.data['results'], list(expected))
+
+    def test_benchmark_command_runs(self):
+        out = StringIO()
+        call_command('bench_serializers', limit=10, rounds=1, stdout=out)
+        self.assertIn('polls', out.getvalue())
+        self.assertIn('votes', out.getvalue())
+
+
+class ConditionalGetTest(LunchPollTestCase):
+    def revalidate(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        return self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    def test_unchanged_poll_returns_304(self):
+        for url in (f'/polls/{self.poll.pk}/', f'/polls/{self.poll.pk}/results/',
+                    f'/polls/api/polls/{self.poll.pk}/'):
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url).status_code, 304)
+
+    def test_vote_edit_and_end_change_the_etag(self):
+        url = f'/polls/api/polls/{self.poll.pk}/'
+        etags = [self.client.get(url)['ETag']]
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.create(user=self.voter, poll=self.poll, choice=self.pizza)
+        etags.append(self.client.get(url)['ETag'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.poll.text = 'Dinner?'
+            self.poll.save()
+        etags.append(self.client.get(url)['ETag'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.poll.active = False
+            self.poll.save()
+        etags.append(self.client.get(url)['ETag'])
+        self.assertEqual(len(set(etags)), 4)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[-1])
+        self.assertEqual(response.status_code, 304)
+
+    def test_version_probe_is_served_from_cache(self):
+        url = f'/polls/{self.poll.pk}/version/'
+        first = self.client.get(url).json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json(), first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.create(user=self.voter, poll=self.poll, choice=self.pizza)
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(url).json()
+        self.assertEqual(second['version'], first['version'] + 1)
+        self.assertFalse([q for q in ctx.captured_queries if 'polls_vote' in q['sql']])
+        self.assertEqual(self.client.get('/polls/0/version/').status_code, 404)
+
+    def test_async_page_shows_flash_messages_to_logged_in_voters(self):
+        self.client.force_login(self.voter)
+        response = self.client.post(f'/polls/{self.poll.pk}/vote/',
+                                    {'choice': self.pizza.pk}, follow=True)
+        self.assertContains(response, 'Your vote has been recorded!')
+        self.assertNotIn('ETag', response)
+        self.assertEqual(self.revalidate(f'/polls/{self.poll.pk}/').status_code, 304)
+
+    def test_saving_stale_poll_keeps_vote_counter(self):
+        stale = Poll.objects.get(pk=self.poll.pk)
+        version = stale.version
+        Vote.objects.create(user=self.voter, poll=self.poll, choice=self.pizza)
+        stale.text = 'Dinner?'
+        stale.save()
+        self.assertEqual(stale.total_votes, 1)
+        self.poll.refresh_from_db()
+        self.assertEqual((self.poll.total_votes, self.poll.version), (1, version + 2))
+
+
+class ResultFragmentCacheTest(LunchPollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_user('viewer'))
+
+    def render_detail(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(f'/polls/{self.poll.pk}/')
+        self.assertEqual(response.status_code, 200)
+        choice_queries = [q for q in ctx.captured_queries if 'polls_choice' in q['sql']]
+        return response.content.decode(), len(choice_queries)
+
+    def test_fragments_are_reused_until_the_poll_changes(self):
+        _, cold = self.render_detail()
+        self.assertEqual(cold, 1)
+        _, warm = self.render_detail()
+        self.assertEqual(warm, 0)
+
+        Vote.objects.create(user=self.voter, poll=self.poll, choice=self.sushi)
+        content, _ = self.render_detail()
+        self.assertIn('Total Votes: <span id="total-votes">1</span>', content)
+
+
+class PollArchiveTest(LunchPollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.voters = [User.objects.create_user(f'voter{i}') for i in range(3)]
+        for voter, choice in zip(self.voters, (self.pizza, self.pizza, self.sushi)):
+            Vote.objects.create(user=voter, poll=self.poll, choice=choice)
+
+    def end_poll(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(f'/polls/end/{self.poll.pk}/')
+        self.assertRedirects(response, f'/polls/{self.poll.pk}/results/')
+
+    def test_end_poll_freezes_results(self):
+        self.end_poll()
+        tally = PollResult.objects.get(poll=self.poll).tally
+        self.assertEqual(tally['total_votes'], 3)
+        self.assertEqual([c['votes'] for c in tally['choices']], [2, 1])
+
+        response = self.client.get(f'/polls/{self.poll.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_votes'], 3)
+
+        self.client.force_login(User.objects.create_user('late'))
+        self.client.post(f'/polls/{self.poll.pk}/vote/', {'choice': self.pizza.pk})
+        self.assertEqual(Vote.objects.filter(poll=self.poll).count(), 3)
+
+    def test_archived_votes_keep_serving_the_snapshot(self):
+        self.end_poll()
+        PollResult.objects.update(archived_at=timezone.now() - timezone.timedelta(days=31))
+        cache.clear()
+        get_site_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_votes', '--batch-size', '2', stdout=StringIO())
+        self.assertEqual(get_site_stats()['total_votes'], 3)
+        cache.clear()
+        self.assertEqual(get_site_stats()['total_votes'], 3)
+
+        self.assertFalse(Vote.objects.filter(poll=self.poll).exists())
+        self.poll.refresh_from_db()
+        self.assertEqual(self.poll.total_votes, 3)
+        self.assertEqual(ArchivedVote.objects.filter(poll=self.poll).count(), 3)
+        Poll.objects.recount_votes()
+        self.assertEqual(tally_poll(self.poll.pk)['total_votes'], 3)
+
+        self.client.logout()
+        with self.assertNumQueries(1):
+            data = self.client.get('/polls/api/polls/').data['results']
+        self.assertEqual([c['votes_count'] for c in data[0]['choices']], [2, 1])
+        data = self.client.get(f'/polls/api/polls/{self.poll.pk}/').data
+        self.assertEqual([c['votes_count'] for c in data['choices']], [2, 1])
+
+
+class VoteRollupTest(LunchPollTestCase):
+    def setUp(self):
+        super().setUp()
+        self.voters = [User.objects.create_user(f'voter{i}') for i in range(4)]
+
+    def rollups(self):
+        return sorted(VoteRollup.objects.filter(votes__gt=0).values_list(
+            'choice_id', 'resolution', 'bucket', 'votes'))
+
+    def test_rollups_follow_inserts_deletes_and_imports(self):
+        Vote.objects.create(user=self.voters[0], poll=self.poll, choice=self.pizza)
+        old = Vote.objects.create(user=self.voters[1], poll=self.poll, choice=self.pizza)
+        Vote.objects.filter(pk=old.pk).update(created_at=old.created_at - timezone.timedelta(hours=3))
+        VoteRollup.rebuild()
+        Vote.objects.create(user=self.voters[2], poll=self.poll, choice=self.sushi)
+        Vote.objects.get(user=self.voters[0]).delete()
+        ingest_votes([{'user': self.voters[3].pk, 'poll': self.poll.pk, 'choice': self.sushi.pk}])
+
+        incremental = self.rollups()
+        self.assertEqual(sum(votes for _, resolution, _, votes in incremental
+                             if resolution == VoteRollup.HOUR), 3)
+        VoteRollup.rebuild()
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_timeline_reads_buckets(self):
+        Vote.objects.create(user=self.voters[0], poll=self.poll, choice=self.pizza)
+        Vote.objects.create(user=self.voters[1], poll=self.poll, choice=self.sushi)
+        Vote.objects.create(user=self.voters[2], poll=self.poll, choice=self.sushi)
+
+        for resolution in ('minute', 'hour', 'day'):
+            with self.subTest(resolution=resolution):
+                with self.assertNumQueries(2):
+                    timeline = poll_timeline(self.poll, resolution)
+                self.assertEqual([c['choice_text'] for c in timeline['choices']], ['pizza', 'sushi'])
+                totals = [sum(column) for column in zip(*[b['votes'] for b in timeline['buckets']])]
+                self.assertEqual(totals, [1, 2])
+
+        response = self.client.get(f'/polls/api/polls/{self.poll.pk}/timeline/?resolution=day')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['resolution'], 'day')
+        response = self.client.get(f'/polls/api/polls/{self.poll.pk}/timeline/?resolution=week')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'/polls/{self.poll.pk}/timeline/?resolution=minute')
+        self.assertEqual(response.context['timeline']['resolution'], 'minute')
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner')
+        same_time = timezone.now()
+        for i in range(7):
+            Poll.objects.create(owner=owner, text=f'Poll {i}', pub_date=same_time,
+                                total_votes=i % 3)
+
+    def walk(self, ordering):
+        paginator = KeysetPaginator(Poll.objects.all(), 3, ordering)
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        return paginator, pages
+
+    def test_pages_cover_every_row_once(self):
+        for ordering in (('-pub_date', '-id'), ('-total_votes', '-id'), ('text', 'id')):
+            paginator, pages = self.walk(ordering)
+            seen = [poll.pk for page in pages for poll in page]
+            expected = list(Poll.objects.order_by(*ordering).values_list('pk', flat=True))
+            self.assertEqual(seen, expected)
+            self.assertFalse(pages[0].has_previous())
+
+            previous = paginator.get_page(pages[-1].previous_cursor)
+            self.assertEqual([p.pk for p in previous], [p.pk for p in pages[-2]])
+
+    def test_invalid_cursor_returns_first_page(self):
+        paginator = KeysetPaginator(Poll.objects.all(), 3, ('-pub_date', '-id'))
+        self.assertEqual(len(paginator.get_page('not-a-cursor')), 3)
+
+    def test_api_uses_cursor_pagination(self):
+        response = self.client.get('/polls/api/polls/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertIsNone(response.data['next'])
+
+
+class DashboardTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('john')
+        self.client.force_login(self.user)
+        owner = User.objects.create_user('owner')
+        for i in range(3):
+            poll = Poll.objects.create(owner=owner, text=f'Poll {i}')
+            choice = poll.choice_set.create(choice_text='yes')
+            for j in range(i):
+                voter = User.objects.create_user(f'voter{i}-{j}')
+                Vote.objects.create(user=voter, poll=poll, choice=choice)
+
+    def get_rows(self):
+        response = self.client.get('/polls/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        return [(row['question'], row['unique_voters'])
+                for row in response.context['poll_data']]
+
+    def test_live_fallback_and_snapshot_agree(self):
+        expected = [('Poll 2', 2), ('Poll 1', 1), ('Poll 0', 0)]
+        self.assertEqual(self.get_rows(), expected)
+
+        call_command('refresh_poll_stats', stdout=StringIO())
+        self.assertEqual(PollStats.objects.count(), 3)
+        self.assertEqual(self.get_rows(), expected)
+
+    def test_refresh_updates_existing_rows(self):
+        PollStats.refresh()
+        poll = Poll.objects.get(text='Poll 0')
+        Vote.objects.create(user=self.user, poll=poll, choice=poll.choice_set.get())
+        PollStats.refresh()
+        self.assertEqual(PollStats.objects.get(poll=poll).unique_voters, 1)
+
+
+class SiteStatsTest(LunchPollTestCase):
+    def test_home_reads_cached_counters(self):
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertEqual(response.context['total_polls'], 1)
+
+    def test_signals_adjust_cached_counters(self):
+        get_site_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.create(user=self.voter, poll=self.poll, choice=self.pizza)
+            Poll.objects.create(owner=self.owner, text='Dinner?')
+        with self.captureOnCommitCallbacks(execute=True):
+            poll = Poll.objects.get(pk=self.poll.pk)
+            poll.active = False
+            poll.save()
+
+        with self.assertNumQueries(0):
+            stats = get_site_stats()
+        self.assertEqual(stats, {'total_polls': 2, 'total_votes': 1, 'total_completed_polls': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            poll.delete()
+        self.assertEqual(get_site_stats(), {'total_polls': 1, 'total_votes': 0, 'total_completed_polls': 0})
+
+
+class BroadcastTest(LunchPollTestCase):
+    def test_ended_poll_state_comes_from_its_frozen_result(self):
+        Vote.objects.create(user=self.voter, poll=self.poll, choice=self.sushi)
+        self.poll.active = False
+        self.poll.save()
+        Choice.objects.filter(pk=self.sushi.pk).update(votes=0)
+
+        version, tally = versioned_tally(self.poll.pk)
+        self.assertEqual(version, self.poll.version)
+        self.assertEqual([choice['votes'] for choice in tally['choices']], [0, 1])
+        self.assertIsNone(versioned_tally(self.poll.pk + 1))
+
+    def test_vote_broadcasts_latest_tally(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f'poll_{self.poll.pk}', channel)
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.create(user=self.voter, poll=self.poll, choice=self.pizza)
+
+        message = async_to_sync(layer.receive)(channel)
+        self.poll.refresh_from_db()
+        self.assertEqual((message['type'], message['seq']), ('poll_update', self.poll.version))
+        self.assertEqual(message['data'], {
+            'choices': [{'id': self.pizza.pk, 'votes': 1, 'percentage': 100.0},
+                        {'id': self.sushi.pk, 'votes': 0, 'percentage': 0}],
+        })
+
+    def test_choice_change_replaces_the_cached_state(self):
+        async_to_sync(current_state)(self.poll.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            tacos = self.poll.choice_set.create(choice_text='tacos')
+
+        state = async_to_sync(current_state)(self.poll.pk)
+        self.poll.refresh_from_db()
+        self.assertEqual(state['seq'], self.poll.version)
+        self.assertEqual([choice['id'] for choice in state['data']['choices']],
+                         [self.pizza.pk, self.sushi.pk, tacos.pk])
+
+    def test_current_state_is_served_from_the_cache(self):
+        with self.assertNumQueries(1):
+            state = async_to_sync(current_state)(self.poll.pk)
+        self.poll.refresh_from_db()
+        self.assertEqual(state['seq'], self.poll.version)
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(current_state)(self.poll.pk), state)
+        self.assertIsNone(async_to_sync(current_state)(self.poll.pk + 1))
+
+    @override_settings(POLL_BROADCAST_WINDOW=0.05)
+    def test_updates_within_a_window_are_merged(self):
+        broadcaster = PollBroadcaster()
+        sent = []
+        flushed = threading.Event()
+
+        def send(poll_id):
+            sent.append(poll_id)
+            if len(sent) == 2:
+                flushed.set()
+
+        with mock.patch.object(broadcaster, 'send', side_effect=send):
+            for _ in range(5):
+                broadcaster.notify(1)
+            broadcaster.notify(2)
+            self.assertTrue(flushed.wait(timeout=5))
+
+        self.assertEqual(sorted(sent), [1, 2])
+        metrics = broadcaster.metrics()
+        self.assertEqual(metrics['requested'], 6)
+        self.assertEqual(metrics['merged'], 4)
+        self.assertEqual(metrics['pending'], 0)
+
+
+def choices_payload(*votes):
+    total = sum(votes)
+    return {'choices': [
+        {'id': pk, 'votes': count, 'percentage': round(count / total * 100, 1) if total else 0}
+        for pk, count in enumerate(votes, start=1)
+    ]}
+
+
+@skipUnless(WebsocketCommunicator, 'daphne is required for channels.testing')
+class DeltaProtocolTest(SimpleTestCase):
+    poll_id = 9001
+
+    def setUp(self):
+        cache.clear()
+
+    def test_diff_choices(self):
+        self.assertEqual(
+            diff_choices(choices_payload(1, 2), choices_payload(1, 3)),
+            [{'id': 2, 'votes': 3}],
+        )
+        self.assertIsNone(diff_choices(choices_payload(1, 2), choices_payload(1, 2, 0)))
+
+    def test_advance_state_chains_poll_versions(self):
+        first = advance_state(self.poll_id, 3, choices_payload(0, 0))
+        self.assertEqual((first['seq'], first['base'], first['delta']), (3, None, None))
+        second = advance_state(self.poll_id, 5, choices_payload(1, 1))
+        self.assertEqual((second['seq'], second['base']), (5, 3))
+        self.assertEqual(second['delta'], [{'id': 1, 'votes': 1}, {'id': 2, 'votes': 1}])
+
+    def test_older_state_is_replaced_by_the_recorded_one(self):
+        # Another worker recorded version 5 after this one read version 4
+        advance_state(self.poll_id, 5, choices_payload(1, 1))
+        stale = advance_state(self.poll_id, 4, choices_payload(1, 0))
+        self.assertEqual(stale, {'seq': 5, 'data': choices_payload(1, 1), 'base': None, 'delta': None})
+        self.assertEqual(cache.get(f'poll_state:{self.poll_id}')['seq'], 5)
+
+    async def connect(self, query=''):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/poll/{self.poll_id}/{query}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def broadcast(self, seq, data):
+        message = build_update_message(self.poll_id, seq, data)
+        await get_channel_layer().group_send(f'poll_{self.poll_id}', message)
+
+    async def test_snapshot_delta_and_resync(self):
+        advance_state(self.poll_id, 1, choices_payload(0, 0))
+        communicator = await self.connect('?protocol=2')
+
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot['type'], 'snapshot')
+        self.assertEqual(snapshot['seq'], 1)
+
+        await self.broadcast(2, choices_payload(0, 1))
+        delta = await communicator.receive_json_from()
+        self.assertEqual(delta, {'type': 'delta', 'seq': 2, 'base': 1,
+                                 'choices': [{'id': 2, 'votes': 1}]})
+
+        await communicator.send_json_to({'action': 'resync'})
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual((snapshot['type'], snapshot['seq']), ('snapshot', 2))
+        self.assertEqual(snapshot['choices'], choices_payload(0, 1)['choices'])
+        await communicator.disconnect()
+
+    @mock.patch('polls.consumers.PollConsumer.get_poll_data', mock.AsyncMock(return_value=None))
+    async def test_legacy_clients_get_full_payloads(self):
+        communicator = await self.connect()
+        await self.broadcast(1, choices_payload(2, 2))
+        self.assertEqual(await communicator.receive_json_from(), choices_payload(2, 2))
+        await communicator.disconnect()
+
+    @mock.patch('polls.consumers.PollConsumer.get_poll_data', mock.AsyncMock(return_value=None))
+    async def test_pre_encoded_frames_are_forwarded_verbatim(self):
+        communicator = await self.connect()
+        await get_channel_layer().group_send(f'poll_{self.poll_id}', {
+            'type': 'poll_update',
+            'data': choices_payload(1),
+            'frames': {'v1': '{"choices": "as sent"}'},
+        })
+        self.assertEqual(await communicator.receive_from(), '{"choices": "as sent"}')
+        await communicator.disconnect()
+
+    async def test_coalesced_broadcast_reaches_sockets_on_the_server_loop(self):
+        advance_state(self.poll_id, 1, choices_payload(0, 0))
+        communicator = await self.connect('?protocol=2')
+        await communicator.receive_json_from()
+
+        # The broadcaster's background thread has no event loop of its own
+        tally = {'total_votes': 1, 'choices': [
+            {'id': 1, 'votes': 1, 'percentage': 100.0}, {'id': 2, 'votes': 0, 'percentage': 0}]}
+        with override_settings(POLL_BROADCAST_WINDOW=0.05), \
+                mock.patch('polls.broadcast.versioned_tally', return_value=(2, tally)):
+            broadcaster.notify(self.poll_id)
+            delta = await communicator.receive_json_from(timeout=1)
+        self.assertEqual(delta['choices'], [{'id': 1, 'votes': 1}])
+        await communicator.disconnect()
+
+    async def test_concurrent_connects_share_one_state_lookup(self):
+        calls = []
+        release = asyncio.Event()
+
+        async def slow_state(poll_id):
+            calls.append(poll_id)
+            await release.wait()
+            return {'seq': 1, 'data': choices_payload(1, 0)}
+
+        with mock.patch('polls.consumers.current_state', side_effect=slow_state):
+            waiters = [asyncio.ensure_future(load_state(self.poll_id)) for _ in range(20)]
+            await asyncio.sleep(0.05)
+            release.set()
+            states = await asyncio.gather(*waiters)
+
+        self.assertEqual(calls, [self.poll_id])
+        self.assertTrue(all(state['seq'] == 1 for state in states))
+
+    async def test_subscribers_per_poll_are_capped(self):
+        advance_state(self.poll_id, 1, choices_payload(0, 0))
+        registry = SocketRegistry()
+        with override_settings(POLL_MAX_SUBSCRIBERS=1), \
+                mock.patch('polls.consumers.socket_registry', registry):
+            first = await self.connect('?protocol=2')
+            await first.receive_json_from()
+            second = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f'/ws/poll/{self.poll_id}/?protocol=2')
+            connected, _ = await second.connect()
+            self.assertFalse(connected)
+
+            metrics = registry.metrics()
+            self.assertEqual((metrics['connected'], metrics['rejected']), (1, 1))
+            self.assertEqual(metrics['polls'][str(self.poll_id)]['sent'], 1)
+            await first.disconnect()
+        self.assertEqual(registry.metrics()['polls'], {})
+
+    async def test_slow_socket_skips_to_the_latest_snapshot(self):
+        registry = SocketRegistry()
+        registry.join(self.poll_id)
+        consumer = PollConsumer()
+        consumer.poll_id = self.poll_id
+        consumer.protocol = DELTA_VERSION
+        consumer.use_msgpack = False
+        consumer.frame_name = consumer.get_frame_name()
+        with override_settings(POLL_SOCKET_QUEUE_LIMIT=2), \
+                mock.patch('polls.consumers.socket_registry', registry):
+            consumer.init_outbox()
+            for votes in range(5):
+                await consumer.poll_update(
+                    build_update_message(self.poll_id, votes + 1, choices_payload(votes, 1)))
+
+            sent = []
+            consumer.base_send = mock.AsyncMock(side_effect=sent.append)
+            await consumer.drain_outbox()
+
+        self.assertEqual(len(sent), 1)
+        frame = json.loads(sent[0]['text'])
+        self.assertEqual((frame['type'], frame['seq']), ('snapshot', 5))
+        self.assertEqual(frame['choices'], choices_payload(4, 1)['choices'])
+        metrics = registry.metrics()
+        self.assertEqual((metrics['queued'], metrics['dropped'], metrics['sent']), (5, 4, 1))
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    async def test_msgpack_encoding(self):
+        advance_state(self.poll_id, 1, choices_payload(0, 0))
+        communicator = await self.connect('?protocol=2&encoding=msgpack')
+        snapshot = msgpack.unpackb((await communicator.receive_output())['bytes'])
+        self.assertEqual((snapshot['type'], snapshot['seq']), ('snapshot', 1))
+
+        await self.broadcast(2, choices_payload(1, 0))
+        delta = msgpack.unpackb((await communicator.receive_output())['bytes'])
+        self.assertEqual(delta['choices'], [{'id': 1, 'votes': 1}])
+        await communicator.disconnect()
+
+
+class PollStreamTest(SimpleTestCase):
+    poll_id = 9002
+
+    def stream(self):
+        return ApplicationCommunicator(URLRouter(http_urlpatterns), {
+            'type': 'http',
+            'method': 'GET',
+            'path': f'/polls/{self.poll_id}/stream/',
+            'query_string': b'',
+            'headers': [],
+        })
+
+    @mock.patch('polls.consumers.PollStreamConsumer.get_poll_data',
+                mock.AsyncMock(return_value=choices_payload(1, 0)))
+    async def test_streams_initial_state_and_updates(self):
+        communicator = self.stream()
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+
+        start = await communicator.receive_output()
+        self.assertEqual(start['status'], 200)
+        self.assertIn((b'Content-Type', b'text/event-stream'), start['headers'])
+        self.assertEqual((await communicator.receive_output())['body'], b'retry: 2000\n\n')
+        initial = await communicator.receive_output()
+        self.assertEqual(initial['body'], f'data: {json.dumps(choices_payload(1, 0))}\n\n'.encode())
+
+        await get_channel_layer().group_send(f'poll_{self.poll_id}', {
+            'type': 'poll_update',
+            'data': choices_payload(1, 1),
+            'frames': {'v1': json.dumps(choices_payload(1, 1))},
+        })
+        update = await communicator.receive_output()
+        self.assertEqual(update['body'], f'data: {json.dumps(choices_payload(1, 1))}\n\n'.encode())
+        self.assertTrue(update['more_body'])
+
+        await communicator.send_input({'type': 'http.disconnect'})
+        await communicator.wait()
+
+    @mock.patch('polls.consumers.PollStreamConsumer.get_poll_data', mock.AsyncMock(return_value=None))
+    async def test_unknown_poll_is_404(self):
+        communicator = self.stream()
+        await communicator.send_input({'type': 'http.request', 'body': b''})
+        self.assertEqual((await communicator.receive_output())['status'], 404)
+        await communicator.wait()
+
+
+@skipUnless(channels_redis and TcpFakeServer, 'channels_redis and fakeredis are required')
+class ChannelLayerFanOutTest(SimpleTestCase):
+    """
+    Run several manage.py worker processes against one fake Redis server and
+    check that a poll_update sent from one process reaches all the others
+    """
+    workers = 3
+
+    def setUp(self):
+        self.server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def run_command(self, backend, *args):
+        host, port = self.server.server_address
+        env = dict(
+            os.environ,
+            CHANNEL_LAYER_URL=f'redis://{host}:{port}/0',
+            CHANNEL_LAYER_BACKEND=backend,
+        )
+        return subprocess.Popen(
+            [sys.executable, '-u', 'manage.py', 'channel_layer_probe', *args],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.PIPE, text=True,
+        )
+
+    def check_fan_out(self, backend):
+        listeners = [self.run_command(backend, 'listen', '7') for _ in range(self.workers)]
+        for listener in listeners:
+            self.addCleanup(listener.kill)
+            self.assertEqual(listener.stdout.readline().strip(), 'ready')
+
+        data = {'choices': [{'id': 1, 'votes': 3, 'percentage': 100.0}]}
+        sender = self.run_command(backend, 'send', '7', '--data', json.dumps(data))
+        self.assertEqual(sender.wait(timeout=30), 0)
+
+        for listener in listeners:
+            output, _ = listener.communicate(timeout=30)
+            self.assertEqual(listener.returncode, 0)
+            self.assertEqual(json.loads(output), data)
+
+    def test_redis_layer_fan_out(self):
+        self.check_fan_out('redis')
+
+    def test_redis_pubsub_layer_fan_out(self):
+        self.check_fan_out('redis-pubsub')
+
+
 class PollViewTest(TestCase):
     def test_home(self):
         response = self.client.get('/')
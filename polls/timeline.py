@@ -0,0 +1,64 @@
+"""
+Vote timelines read from the ``VoteRollup`` buckets.
+
+Minute and hour series come straight from their rollup rows; day series
+are summed from the hourly rows in the site's time zone. A timeline costs
+two queries (choices and buckets) however many votes the poll has, and
+buckets without votes are left out.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .models import Choice, VoteRollup
+
+MINUTE = VoteRollup.MINUTE
+HOUR = VoteRollup.HOUR
+DAY = 'day'
+
+# How far back each resolution reaches when no ``since`` is given
+DEFAULT_SPANS = {
+    MINUTE: timedelta(hours=2),
+    HOUR: timedelta(days=7),
+    DAY: None,
+}
+
+
+def _day_start(moment):
+    local = timezone.localtime(moment)
+    return timezone.make_aware(datetime.combine(local.date(), time()))
+
+
+def poll_timeline(poll, resolution=HOUR, since=None):
+    """
+    Return ``{'resolution', 'choices': [{'id', 'choice_text'}], 'buckets':
+    [{'start', 'votes'}]}`` for ``poll``, where each bucket's ``votes``
+    lists the counts in ``choices`` order. Raises ``ValueError`` for an
+    unknown resolution.
+    """
+    if resolution not in DEFAULT_SPANS:
+        raise ValueError(f'Unknown resolution {resolution!r}')
+    if since is None and DEFAULT_SPANS[resolution] is not None:
+        since = timezone.now() - DEFAULT_SPANS[resolution]
+
+    poll_id = getattr(poll, 'pk', poll)
+    choices = list(Choice.objects.filter(poll_id=poll_id).order_by('id').values('id', 'choice_text'))
+    columns = {choice['id']: index for index, choice in enumerate(choices)}
+
+    rows = VoteRollup.objects.filter(
+        poll_id=poll_id, resolution=MINUTE if resolution == MINUTE else HOUR, votes__gt=0)
+    if since is not None:
+        rows = rows.filter(bucket__gte=_day_start(since) if resolution == DAY else since)
+
+    buckets = defaultdict(lambda: [0] * len(choices))
+    for choice_id, bucket, votes in rows.values_list('choice_id', 'bucket', 'votes'):
+        start = _day_start(bucket) if resolution == DAY else bucket
+        buckets[start][columns[choice_id]] += votes
+
+    return {
+        'resolution': resolution,
+        'choices': choices,
+        'buckets': [{'start': start.isoformat(), 'votes': buckets[start]}
+                    for start in sorted(buckets)],
+    }
@@ -8,6 +8,7 @@ app_name = "polls"
 urlpatterns = [
     path('list/', views.polls_list, name='list'),
     path('list/user/', views.list_by_user, name='list_by_user'),
+    path('dashboard/', views.dashboard, name='dashboard'),
     path('add/', views.polls_add, name='add'),
     path('edit/<int:poll_id>/', views.polls_edit, name='edit'),
     path('delete/<int:poll_id>/', views.polls_delete, name='delete'),
@@ -18,16 +19,21 @@ urlpatterns = [
     path('<int:poll_id>/', views.poll_detail, name='detail'),
     path('<int:poll_id>/vote/', views.poll_vote, name='vote'),
     path('<int:poll_id>/results/', views.poll_results, name='results'),
+    path('<int:poll_id>/timeline/', views.poll_timeline, name='timeline'),
+    path('<int:poll_id>/version/', views.poll_version, name='version'),
+    path('metrics/', views.realtime_metrics, name='realtime_metrics'),
 ]
 
 # API URL patterns
 api_urlpatterns = [
     path('api/polls/', views.PollViewSet.as_view({'get': 'list', 'post': 'create'}), name='poll-list'), 
     path('api/polls/<int:pk>/', views.PollViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}), name='poll-detail'), 
+    path('api/polls/<int:pk>/timeline/', views.PollViewSet.as_view({'get': 'timeline'}), name='poll-timeline'),
     path('api/choices/', views.ChoiceViewSet.as_view({'get': 'list', 'post': 'create'}), name='choice-list'), 
     path('api/choices/<int:pk>/', views.ChoiceViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}), name='choice-detail'), 
     path('api/choices/<int:pk>/vote/', views.ChoiceViewSet.as_view({'post': 'vote'}), name='choice-vote'), 
     path('api/votes/', views.VoteViewSet.as_view({'get': 'list', 'post': 'create'}), name='vote-list'), 
+    path('api/votes/bulk/', views.VoteViewSet.as_view({'post': 'bulk'}), name='vote-bulk'),
     path('api/votes/<int:pk>/', views.VoteViewSet.as_view({'get': 'retrieve', 'delete': 'destroy'}), name='vote-detail')]
 
 # Add API URLs to urlpatterns
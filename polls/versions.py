@@ -0,0 +1,65 @@
+"""
+Cached ``Poll.version`` stamps for conditional GETs and the version probe.
+
+Votes, edits and ends bump the version in the database; once the change
+commits the poll's entry is dropped from the cache named by
+``POLL_VERSION_CACHE`` and the next reader refills it from a primary key
+lookup on ``Poll``. The vote table is never read. Entries expire after
+``POLL_VERSION_TIMEOUT`` seconds, which bounds how long a reader racing a
+commit can leave an outdated stamp behind.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def _cache():
+    return caches[getattr(settings, 'POLL_VERSION_CACHE', 'default')]
+
+
+def _key(poll_id):
+    return f'poll_version:{poll_id}'
+
+
+def get_poll_version(poll_id):
+    """
+    Return the poll's ``(version, modified_at)``, or ``None`` if it does not
+    exist
+    """
+    from .models import Poll
+
+    cache = _cache()
+    stamp = cache.get(_key(poll_id))
+    if stamp is None:
+        stamp = Poll.objects.filter(pk=poll_id).values_list('version', 'modified_at').first()
+        if stamp is None:
+            return None
+        # add() so a reader never overwrites a newer stamp
+        cache.add(_key(poll_id), stamp, getattr(settings, 'POLL_VERSION_TIMEOUT', 60))
+    return tuple(stamp)
+
+
+async def aget_poll_version(poll_id):
+    """
+    Async ``get_poll_version()`` for async views
+    """
+    from .models import Poll
+
+    cache = _cache()
+    stamp = await cache.aget(_key(poll_id))
+    if stamp is None:
+        stamp = await Poll.objects.filter(pk=poll_id).values_list('version', 'modified_at').afirst()
+        if stamp is None:
+            return None
+        await cache.aadd(_key(poll_id), stamp, getattr(settings, 'POLL_VERSION_TIMEOUT', 60))
+    return tuple(stamp)
+
+
+def forget_poll_versions(poll_ids):
+    """
+    Drop the cached stamps of ``poll_ids`` once the current transaction
+    commits
+    """
+    keys = [_key(poll_id) for poll_id in poll_ids]
+    if keys:
+        transaction.on_commit(lambda: _cache().delete_many(keys))
@@ -1,10 +1,22 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import IntegrityError
 from django.db.models import Count
 from django.contrib import messages
-from .models import Poll, Choice, Vote
+from .models import Poll, Choice, Vote, PollStats
 from .forms import PollAddForm, EditPollForm, ChoiceAddForm
+from .tally import atally_poll
+from .timeline import poll_timeline as build_timeline, DEFAULT_SPANS as TIMELINE_RESOLUTIONS
+from .conditional import poll_api_condition, poll_page_condition
+from .versions import aget_poll_version
+from .broadcast import broadcaster
+from .buffer import vote_buffer, buffering_enabled, VoteBufferFull
+from .sockets import socket_registry
+from .pagination import (
+    KeysetPaginator, PollCursorPagination, ChoiceCursorPagination, VoteCursorPagination,
+)
 from django.http import HttpResponse
 from django.core.mail import send_mail
 from django.conf import settings  # To access your email settings
@@ -12,18 +24,22 @@ from django.http import JsonResponse
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 from django.forms import inlineformset_factory
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from rest_framework import viewsets, permissions
-from .serializers import PollSerializer, ChoiceSerializer, VoteSerializer
+from .serializers import (
+    PollSerializer, ChoiceSerializer, VoteSerializer, BulkVoteSerializer,
+    POLL_LIST_FIELDS, VOTE_LIST_FIELDS, poll_list_data, vote_list_data,
+)
+from .ingest import ingest_votes
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 
 
 @login_required()
 def polls_list(request):
-    all_polls = Poll.objects.all()
+    all_polls = Poll.objects.with_listing_data(request.user)
     search_term = ""
     
     # Add user filter
@@ -32,27 +48,26 @@ def polls_list(request):
         all_polls = all_polls.filter(owner__username=username)
     
     # Add default ordering
-    all_polls = all_polls.order_by('-pub_date')
-    
+    ordering = ('-pub_date', '-id')
+
     if "name" in request.GET:
-        all_polls = all_polls.order_by("text")
+        ordering = ('text', 'id')
 
     if "date" in request.GET:
-        all_polls = all_polls.order_by("-pub_date")
+        ordering = ('-pub_date', '-id')
 
     if "vote" in request.GET:
-        all_polls = all_polls.annotate(Count("vote")).order_by("-vote__count")
+        ordering = ('-total_votes', '-id')
 
     if "search" in request.GET:
         search_term = request.GET["search"]
         all_polls = all_polls.filter(text__icontains=search_term)
 
-    paginator = Paginator(all_polls, 6)
-    page = request.GET.get("page")
-    polls = paginator.get_page(page)
+    paginator = KeysetPaginator(all_polls, 6, ordering)
+    polls = paginator.get_page(request.GET.get("cursor"))
 
     get_dict_copy = request.GET.copy()
-    params = get_dict_copy.pop("page", True) and get_dict_copy.urlencode()
+    params = get_dict_copy.pop("cursor", True) and get_dict_copy.urlencode()
 
     context = {
         "polls": polls,
@@ -64,24 +79,35 @@ def polls_list(request):
 
 @login_required()
 def dashboard(request):
-    polls = Poll.objects.all()
-    poll_data = []
-
-    for poll in polls:
-        unique_voters = Vote.objects.filter(poll=poll).values("user").distinct().count()
-        poll_data.append({"question": poll.text, "unique_voters": unique_voters})
-
-    context = {"poll_data": poll_data}
+    stats = PollStats.objects.select_related('poll')
+    refreshed_at = stats.values_list('refreshed_at', flat=True).first()
+    cursor = request.GET.get("cursor")
+
+    if refreshed_at is not None:
+        page = KeysetPaginator(stats, 20, ('-unique_voters', '-poll_id')).get_page(cursor)
+        poll_data = [
+            {"question": row.poll.text, "unique_voters": row.unique_voters}
+            for row in page
+        ]
+    else:
+        # No snapshot yet: fall back to a single live aggregate query
+        polls = Poll.objects.annotate(unique_voters=Count("vote__user", distinct=True))
+        page = KeysetPaginator(polls, 20, ('-unique_voters', '-id')).get_page(cursor)
+        poll_data = [
+            {"question": poll.text, "unique_voters": poll.unique_voters}
+            for poll in page
+        ]
+
+    context = {"poll_data": poll_data, "page": page, "refreshed_at": refreshed_at}
     return render(request, "polls/dashboard.html", context)
 
 
 @login_required()
 def list_by_user(request):
-    all_polls = Poll.objects.filter(owner=request.user)
-    paginator = Paginator(all_polls, 7)  # Show 7 contacts per page
+    all_polls = Poll.objects.filter(owner=request.user).with_listing_data(request.user)
+    paginator = KeysetPaginator(all_polls, 7, ('-pub_date', '-id'))  # Show 7 polls per page
 
-    page = request.GET.get("page")
-    polls = paginator.get_page(page)
+    polls = paginator.get_page(request.GET.get("cursor"))
 
     context = {
         "polls": polls,
@@ -237,12 +263,13 @@ def choice_delete(request, choice_id):
     return redirect("polls:edit", poll.id)
 
 
-def poll_detail(request, poll_id):
-    poll = get_object_or_404(Poll, id=poll_id)
-    poll._request_user = request.user
+@poll_page_condition
+async def poll_detail(request, poll_id):
+    poll = await aget_object_or_404(Poll.objects.select_related('owner'), id=poll_id)
+    poll._request_user = await request.auser()
     
     if not poll.active:
-        return render(request, "polls/poll_result.html", {"poll": poll})
+        return await _render_results(request, poll)
     
     # Add last_update timestamp to help with reconnection
     context = {
@@ -250,7 +277,8 @@ def poll_detail(request, poll_id):
         "share_url": request.build_absolute_uri(),
         "last_update": timezone.now().timestamp()
     }
-    return render(request, "polls/poll_detail.html", context)
+    # Templates may still query lazily (request.user, poll.user_can_vote)
+    return await sync_to_async(render)(request, "polls/poll_detail.html", context)
 
 
 @login_required(login_url='accounts:login')
@@ -265,54 +293,44 @@ def poll_vote(request, poll_id):
             extra_tags='alert alert-warning alert-dismissible fade show'
         )
         return redirect('polls:detail', poll_id=poll_id)
-    
-    # Check if user has already voted
-    if Vote.objects.filter(user=request.user, poll=poll).exists():
+
+    if not poll.active:
         messages.error(
             request,
-            "You have already voted on this poll!",
+            "This poll is closed.",
             extra_tags='alert alert-warning alert-dismissible fade show'
         )
-        return redirect('polls:detail', poll_id=poll_id)
+        return redirect('polls:results', poll_id=poll_id)
     
     if request.method == 'POST':
         try:
             choice = poll.choice_set.get(pk=request.POST['choice'])
-            Vote.objects.create(user=request.user, poll=poll, choice=choice)
-
-            try:
-                # Try to broadcast the update
-                choices_data = []
-                total_votes = poll.get_vote_count
-                for poll_choice in poll.choice_set.all():
-                    choice_votes = poll_choice.get_vote_count
-                    choices_data.append({
-                        'id': poll_choice.id,
-                        'votes': choice_votes,
-                        'percentage': round((choice_votes / total_votes * 100), 1) if total_votes > 0 else 0
-                    })
-
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    f'poll_{poll_id}',
-                    {
-                        'type': 'poll_update',
-                        'data': {
-                            'choices': choices_data
-                        }
-                    }
-                )
-            except Exception:
-                # If real-time update fails, just continue
-                pass
-
-            messages.success(
+            # The unique (user, poll) constraint rejects repeat votes, so no
+            # separate "already voted" lookup is needed. Connected clients are
+            # updated by polls.broadcast once the vote commits.
+            if buffering_enabled():
+                # Written in a batch by polls.buffer on its next flush, which
+                # drops repeat votes silently, so they are rejected here
+                if Vote.objects.filter(user=request.user, poll=poll).exists():
+                    raise IntegrityError('Vote already recorded')
+                if not vote_buffer.submit(request.user.pk, poll.pk, choice.pk):
+                    raise IntegrityError('Vote already waiting in the buffer')
+            else:
+                Vote.objects.create(user=request.user, poll=poll, choice=choice)
+        except VoteBufferFull:
+            messages.error(
                 request,
-                "Your vote has been recorded!",
-                extra_tags='alert alert-success alert-dismissible fade show'
+                "Voting is busy right now, please try again in a moment.",
+                extra_tags='alert alert-warning alert-dismissible fade show'
+            )
+            return redirect('polls:detail', poll_id=poll_id)
+        except IntegrityError:
+            messages.error(
+                request,
+                "You have already voted on this poll!",
+                extra_tags='alert alert-warning alert-dismissible fade show'
             )
             return redirect('polls:detail', poll_id=poll_id)
-            
         except (KeyError, Choice.DoesNotExist):
             messages.error(
                 request,
@@ -322,7 +340,14 @@ def poll_vote(request, poll_id):
             return render(request, 'polls/poll_detail.html', {
                 'poll': poll,
             })
-    
+        else:
+            messages.success(
+                request,
+                "Your vote has been recorded!",
+                extra_tags='alert alert-success alert-dismissible fade show'
+            )
+            return redirect('polls:detail', poll_id=poll_id)
+
     return render(request, 'polls/poll_detail.html', {'poll': poll})
 
 
@@ -333,42 +358,92 @@ def end_poll(request, poll_id):
         return redirect("home")
 
     if poll.active is True:
+        # Saving the ended poll freezes its results (see polls.signals)
         poll.active = False
         poll.save()
-        return render(request, "polls/poll_result.html", {"poll": poll})
-    else:
-        return render(request, "polls/poll_result.html", {"poll": poll})
+    return redirect('polls:results', poll_id=poll_id)
+
 
+async def _render_results(request, poll):
+    results = await atally_poll(poll)
 
-def poll_results(request, poll_id):
+    context = {
+        'poll': poll,
+        'choices_with_stats': results['choices'],
+        'total_votes': results['total_votes'],
+    }
+    return await sync_to_async(render)(request, 'polls/poll_results.html', context)
+
+
+@poll_page_condition
+async def poll_results(request, poll_id):
+    poll = await aget_object_or_404(Poll.objects.select_related('owner'), pk=poll_id)
+    return await _render_results(request, poll)
+
+
+async def poll_version(request, poll_id):
+    """
+    Cheap probe for clients without a live connection: they refetch the
+    results only when the version changes
+    """
+    stamp = await aget_poll_version(poll_id)
+    if stamp is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    version, modified_at = stamp
+    response = JsonResponse({'id': poll_id, 'version': version, 'modified_at': modified_at})
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def poll_timeline(request, poll_id):
     poll = get_object_or_404(Poll, pk=poll_id)
-    votes = Vote.objects.filter(poll=poll).select_related('choice', 'user')
-    
-    # Calculate vote percentages
-    total_votes = votes.count()
-    choices_with_stats = []
-    
-    for choice in poll.choice_set.all():
-        choice_votes = votes.filter(choice=choice).count()
-        percentage = (choice_votes / total_votes * 100) if total_votes > 0 else 0
-        choices_with_stats.append({
-            'choice': choice,
-            'votes': choice_votes,
-            'percentage': round(percentage, 1)
-        })
-    
+    try:
+        timeline = build_timeline(poll, request.GET.get('resolution', 'hour'))
+    except ValueError:
+        timeline = build_timeline(poll)
     context = {
         'poll': poll,
-        'choices_with_stats': choices_with_stats,
-        'total_votes': total_votes,
+        'timeline': timeline,
+        'resolutions': list(TIMELINE_RESOLUTIONS),
     }
-    return render(request, 'polls/poll_results.html', context)
+    return render(request, 'polls/poll_timeline.html', context)
+
+
+@staff_member_required
+def realtime_metrics(request):
+    return JsonResponse({
+        'broadcast': broadcaster.metrics(),
+        'vote_buffer': vote_buffer.metrics(),
+        'sockets': socket_registry.metrics(),
+    })
 
 
 class PollViewSet(viewsets.ModelViewSet):
     queryset = Poll.objects.all()
     serializer_class = PollSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = PollCursorPagination
+
+    def get_queryset(self):
+        return Poll.objects.with_choices()
+
+    def list(self, request, *args, **kwargs):
+        # Read-only fast path, same output as PollSerializer(many=True)
+        queryset = self.filter_queryset(Poll.objects.values(*POLL_LIST_FIELDS))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(poll_list_data(page))
+
+    @method_decorator(poll_api_condition)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=True)
+    def timeline(self, request, pk=None):
+        poll = get_object_or_404(Poll, pk=pk)
+        try:
+            return Response(build_timeline(poll, request.query_params.get('resolution', 'hour')))
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=400)
 
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
@@ -378,17 +453,19 @@ class ChoiceViewSet(viewsets.ModelViewSet):
     queryset = Choice.objects.all()
     serializer_class = ChoiceSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = ChoiceCursorPagination
 
     @action(detail=True, methods=['post'])
     def vote(self, request, pk=None):
         choice = self.get_object()
         user = request.user
-        
-        # Check if user already voted for this poll
-        if Vote.objects.filter(choice__poll=choice.poll, user=user).exists():
+        if not Poll.objects.filter(pk=choice.poll_id, active=True).exists():
+            return Response({'detail': 'This poll is closed.'}, status=400)
+
+        try:
+            vote = Vote.objects.create(choice=choice, poll_id=choice.poll_id, user=user)
+        except IntegrityError:
             return Response({'detail': 'You have already voted in this poll.'}, status=400)
-        
-        vote = Vote.objects.create(choice=choice, poll=choice.poll, user=user)
         serializer = VoteSerializer(vote)
         return Response(serializer.data)
 
@@ -397,6 +474,48 @@ class VoteViewSet(viewsets.ModelViewSet):
     queryset = Vote.objects.all()
     serializer_class = VoteSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = VoteCursorPagination
+
+    def get_permissions(self):
+        if self.action == 'bulk':
+            # Imports record votes on behalf of other users
+            return [permissions.IsAdminUser()]
+        return super().get_permissions()
+
+    def list(self, request, *args, **kwargs):
+        # Read-only fast path, same output as VoteSerializer(many=True)
+        queryset = self.filter_queryset(self.get_queryset().values(*VOTE_LIST_FIELDS))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(vote_list_data(page))
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        try:
+            serializer.save(user=self.request.user)
+        except IntegrityError:
+            raise ValidationError({'detail': 'You have already voted in this poll.'})
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        items = request.data.get('votes') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list):
+            return Response({'detail': 'Expected a list of votes.'}, status=400)
+        max_items = getattr(settings, 'BULK_VOTE_MAX_ITEMS', 10000)
+        if len(items) > max_items:
+            return Response({'detail': f'At most {max_items} votes per request.'}, status=400)
+
+        child = BulkVoteSerializer()
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            try:
+                valid.append((index, child.run_validation(item)))
+            except ValidationError as e:
+                results[index] = {'status': 'invalid', 'errors': e.detail}
+
+        for (index, _), result in zip(valid, ingest_votes([item for _, item in valid])):
+            results[index] = result
+
+        return Response({
+            'created': sum(result['status'] == 'created' for result in results),
+            'results': results,
+        })